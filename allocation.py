@@ -0,0 +1,201 @@
+import collections
+import logging
+import math
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import cvxpy as cp
+import numpy as np
+import pandas as pd
+from pypfopt.discrete_allocation import DiscreteAllocation
+from scipy.optimize import linprog
+
+# translates the time budget (seconds) and node limit into the options of the respective cvxpy solver
+solver_options = {
+    'GUROBI': lambda t, nodes: {'TimeLimit': t, 'NodeLimit': nodes},
+    'CBC': lambda t, nodes: {'maximumSeconds': max(1, int(t)), 'maximumNodes': nodes},
+    'SCIP': lambda t, nodes: {'scip_params': {'limits/time': t, 'limits/nodes': nodes}},
+    'SCIPY': lambda t, nodes: {'scipy_options': {'time_limit': t, 'node_limit': nodes}},
+    'HIGHS': lambda t, nodes: {'time_limit': t, 'mip_max_nodes': nodes},
+}
+builtin_solver = 'BNB'
+
+
+class AllocationError(Exception):
+    """
+    Raised if a solver could not find an allocation within its budget
+    """
+    pass
+
+
+@dataclass
+class AllocationReport:
+    """
+    Describes how a discrete allocation was computed
+    """
+    method: str
+    solve_time: float
+    fallback_reason: Optional[str] = None
+    # why the solver stopped before proving its allocation optimal, None if it is optimal
+    early_stop: Optional[str] = None
+
+
+def lp_allocation(weights: Dict[str, float], latest_prices: pd.Series, total_portfolio_value, solvers: List[str],
+                  time_budget: float, node_limit: int):
+    """
+    Allocates the portfolio optimally utilizing integer programming.
+
+    The solvers are tried in the given order until one finds an allocation within the remaining time budget. A solver
+    running out of budget returns its best allocation so far, which is reported as an early stop. If none succeeds, the
+    portfolio is allocated greedily. Equals DiscreteAllocation.lp_portfolio for long-only weights.
+    """
+    start = time.perf_counter()
+    tickers = list(weights.keys())
+    p = latest_prices[tickers].values.astype(float)
+    w = np.fromiter(weights.values(), dtype=float)
+    reasons = []
+
+    for solver in solvers:
+        remaining = time_budget - (time.perf_counter() - start)
+        if remaining <= 0:
+            reasons.append('time budget exhausted')
+            break
+
+        try:
+            if solver == builtin_solver:
+                x, early_stop = _branch_and_bound(p, w, total_portfolio_value, start + time_budget, node_limit)
+            else:
+                x, early_stop = _solve_cvxpy(solver, p, w, total_portfolio_value, remaining, node_limit)
+        except AllocationError as e:
+            logging.info(f"Allocation with solver {solver} failed: {e}")
+            reasons.append(f'{solver}: {e}')
+            continue
+
+        vals = np.rint(x).astype(int)
+        allocation = collections.OrderedDict((t, v) for t, v in zip(tickers, vals) if v != 0)
+        leftover = total_portfolio_value - p @ vals
+        return allocation, leftover, AllocationReport(solver, time.perf_counter() - start, early_stop=early_stop)
+
+    if not solvers:
+        reasons.append('no solver configured')
+
+    da = DiscreteAllocation(weights, latest_prices, total_portfolio_value=total_portfolio_value)
+    allocation, leftover = da.greedy_portfolio(reinvest=True)
+    return allocation, leftover, AllocationReport('greedy', time.perf_counter() - start, '; '.join(reasons))
+
+
+def _solve_cvxpy(solver, p, w, total_portfolio_value, time_budget, node_limit):
+    """
+    Solves the allocation problem of DiscreteAllocation.lp_portfolio with a mixed-integer cvxpy solver.
+
+    Returns the allocation and why the solver stopped early, None if the allocation is optimal.
+    """
+    if solver not in cp.installed_solvers():
+        raise AllocationError('solver is not installed')
+
+    n = len(p)
+    x = cp.Variable(n, integer=True)
+    r = total_portfolio_value - p.T @ x
+    eta = w * total_portfolio_value - cp.multiply(x, p)
+    u = cp.Variable(n)
+    constraints = [eta <= u, eta >= -u, x >= 0, r >= 0]
+    problem = cp.Problem(cp.Minimize(cp.sum(u) + r), constraints)
+
+    options = solver_options.get(solver, lambda t, nodes: {})(time_budget, node_limit)
+    try:
+        problem.solve(solver=solver, **options)
+    except cp.error.SolverError as e:
+        raise AllocationError(str(e))
+
+    if x.value is None:
+        raise AllocationError(f'solver status {problem.status}')
+    if problem.status == cp.OPTIMAL:
+        return x.value, None
+    # the solvers report stopping at the time or node limit with a feasible allocation as one of these
+    if problem.status in {cp.OPTIMAL_INACCURATE, cp.USER_LIMIT}:
+        if p @ np.rint(x.value) > total_portfolio_value + 1e-6:
+            raise AllocationError('solver stopped without feasible allocation')
+        return x.value, f'solver status {problem.status}'
+
+    raise AllocationError(f'solver status {problem.status}')
+
+
+def _branch_and_bound(p, w, total_portfolio_value, deadline, node_limit):
+    """
+    Solves the allocation problem with a depth-first branch-and-bound on the LP relaxation.
+
+    The variables are the share quantities x and the absolute deviations u from the target values. Returns the best
+    allocation found and why the search stopped early, None if it completed and the allocation is optimal. Only if the
+    search stops before finding any allocation, AllocationError is raised.
+    """
+    n = len(p)
+    target = w * total_portfolio_value
+    c = np.concatenate([-p, np.ones(n)])  # sum(u) + leftover, without the constant total_portfolio_value
+    eye = np.eye(n)
+    A_ub = np.block([[-np.diag(p), -eye], [np.diag(p), -eye], [p[None, :], np.zeros((1, n))]])
+    b_ub = np.concatenate([-target, target, [total_portfolio_value]])
+
+    best_x, best_obj = None, math.inf
+    stack = [(np.zeros(n), np.floor(total_portfolio_value / p))]
+    nodes = 0
+    early_stop = None
+
+    while stack:
+        if time.perf_counter() > deadline:
+            early_stop = 'time budget exhausted'
+        elif nodes >= node_limit:
+            early_stop = 'node limit reached'
+        if early_stop is not None:
+            if best_x is None:
+                raise AllocationError(early_stop)
+            break
+        nodes += 1
+
+        lower, upper = stack.pop()
+        res = linprog(c, A_ub=A_ub, b_ub=b_ub, bounds=list(zip(lower, upper)) + [(0, None)] * n, method='highs')
+        if res.status != 0 or res.fun >= best_obj - 1e-9:
+            continue
+
+        x = res.x[:n]
+        candidate = _round_feasible(x, p, target, total_portfolio_value, upper)
+        candidate_obj = np.abs(target - p * candidate).sum() - p @ candidate
+        if candidate_obj < best_obj:
+            best_x, best_obj = candidate, candidate_obj
+
+        frac = np.abs(x - np.rint(x))
+        i = int(np.argmax(frac))
+        if frac[i] <= 1e-6:
+            continue
+
+        down_upper = upper.copy()
+        down_upper[i] = math.floor(x[i])
+        up_lower = lower.copy()
+        up_lower[i] = math.ceil(x[i])
+        # explore the branch closer to the relaxed solution first
+        if x[i] - math.floor(x[i]) < 0.5:
+            stack.append((up_lower, upper))
+            stack.append((lower, down_upper))
+        else:
+            stack.append((lower, down_upper))
+            stack.append((up_lower, upper))
+
+    if best_x is None:
+        raise AllocationError('no feasible allocation found')
+
+    return best_x, early_stop
+
+
+def _round_feasible(x, p, target, total_portfolio_value, upper):
+    """
+    Rounds a relaxed solution down and spends the leftover on the assets furthest below their target value.
+
+    Buying another share never increases the objective as long as it is affordable.
+    """
+    x = np.minimum(np.floor(x + 1e-9), upper)
+    leftover = total_portfolio_value - p @ x
+    for i in np.argsort(-(target - p * x)):
+        if p[i] <= leftover and x[i] < upper[i]:
+            x[i] += 1
+            leftover -= p[i]
+    return x
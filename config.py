@@ -1,17 +1,26 @@
 import configparser
 import logging
 import os
-from appdirs import user_config_dir
+from appdirs import user_config_dir, user_cache_dir
 from pathlib import Path
 
 config_dir = Path(user_config_dir(appname="etfoptimizer"))
 config_file = Path(config_dir, 'etfoptimizer.ini')
+cache_dir = Path(user_cache_dir(appname="etfoptimizer"))
 
 opt_entries = {'cutoff': '0.00001', 'rounding': '5', 'risk_free_rate': '0.02', 'target_risk': '0.1',
                'target_return': '0.05', 'total_portfolio_value': '100000'}
 db_entries = {'dialect': 'postgresql', 'driver': 'psycopg2', 'username': '<username>',
               'password': '<password>', 'host': 'localhost', 'port': '5432', 'database': 'etf_optimization'}
 hist_entries = {'app_key': '<key>'}
+cache_entries = {'max_size_mb': '256'}
+alloc_entries = {'solvers': 'GUROBI,HIGHS,SCIPY,CBC,BNB', 'time_budget': '5', 'node_limit': '10000'}
+result_entries = {'ttl': '86400', 'max_size_mb': '128'}
+job_entries = {'enabled': 'true', 'workers': '2', 'max_age': '3600'}
+coverage_entries = {'max_gap_days': '30'}
+import_entries = {'batch_size': '5000', 'chunk_size': '1000', 'workers': '4', 'requests_per_second': '5',
+                  'ric_batch_size': '100', 'no_data_ttl_days': '7', 'retries': '2', 'retry_backoff': '2'}
+extraetf_entries = {'concurrency': '8', 'requests_per_second': '4', 'retries': '3', 'retry_backoff': '2'}
 config_cache = {}
 
 
@@ -43,6 +52,56 @@ def create_if_not_exists():
     for k, v in hist_entries.items():
         db_section[k] = v
 
+    config.add_section('price-cache')
+    cache_section = config['price-cache']
+    config.set('price-cache', '; upper bound for the in-memory cache of price matrices used by the optimizer', '')
+    for k, v in cache_entries.items():
+        cache_section[k] = v
+
+    config.add_section('allocation')
+    alloc_section = config['allocation']
+    config.set('allocation', '; integer programming solvers tried in order, falls back to greedy allocation when the '
+                             'time budget (seconds) is exhausted', '')
+    for k, v in alloc_entries.items():
+        alloc_section[k] = v
+
+    config.add_section('result-cache')
+    result_section = config['result-cache']
+    config.set('result-cache', '; optimization results shown in the UI are cached on disk for ttl seconds', '')
+    for k, v in result_entries.items():
+        result_section[k] = v
+
+    config.add_section('background-jobs')
+    job_section = config['background-jobs']
+    config.set('background-jobs', '; optimizations started in the UI run in a pool of worker processes if enabled, '
+                                  'files of jobs unchanged for max_age seconds are deleted', '')
+    for k, v in job_entries.items():
+        job_section[k] = v
+
+    config.add_section('coverage')
+    coverage_section = config['coverage']
+    config.set('coverage', '; ISINs with a longer gap (days) in their price history are excluded from optimization', '')
+    for k, v in coverage_entries.items():
+        coverage_section[k] = v
+
+    config.add_section('history-import')
+    import_section = config['history-import']
+    config.set('history-import', '; number of prices per INSERT statement and of rows read at once from Refinitiv '
+                                 'export files', '')
+    config.set('history-import', '; concurrent downloads and API request rate limit of the Refinitiv import', '')
+    config.set('history-import', '; ISINs without prices are skipped for no_data_ttl_days, RICs are looked up again after '
+                                 'the same time', '')
+    config.set('history-import', '; failed requests are retried after retry_backoff seconds, doubling for each retry', '')
+    for k, v in import_entries.items():
+        import_section[k] = v
+
+    config.add_section('extraetf')
+    extraetf_section = config['extraetf']
+    config.set('extraetf', '; concurrent requests and request rate limit when crawling extraetf.com, busy or failing '
+                           'requests are retried after retry_backoff seconds, doubling for each retry', '')
+    for k, v in extraetf_entries.items():
+        extraetf_section[k] = v
+
     with open(config_file, 'w+') as configfile:
         config.write(configfile)
         logging.info("Created initial config")
@@ -68,6 +127,27 @@ def read_config():
     for k, v in hist_entries.items():
         __add_to_cache(config, 'historic-data', k, v)
 
+    for k, v in cache_entries.items():
+        __add_to_cache(config, 'price-cache', k, v)
+
+    for k, v in alloc_entries.items():
+        __add_to_cache(config, 'allocation', k, v)
+
+    for k, v in result_entries.items():
+        __add_to_cache(config, 'result-cache', k, v)
+
+    for k, v in job_entries.items():
+        __add_to_cache(config, 'background-jobs', k, v)
+
+    for k, v in coverage_entries.items():
+        __add_to_cache(config, 'coverage', k, v)
+
+    for k, v in import_entries.items():
+        __add_to_cache(config, 'history-import', k, v)
+
+    for k, v in extraetf_entries.items():
+        __add_to_cache(config, 'extraetf', k, v)
+
     logging.info("Loaded config successfully")
 
 
@@ -78,6 +158,13 @@ def get_value(section, key):
     return config_cache.get(f'{section}.{key}')
 
 
+def get_section(section):
+    """
+    Retrieves all cached config values of the given section as a dict of keys and values
+    """
+    return {k[len(section) + 1:]: v for k, v in config_cache.items() if k.startswith(f'{section}.')}
+
+
 def get_sql_uri(nodriver=False):
     """
     Returns the SQL URI string for connecting to the etf database.
@@ -103,4 +190,5 @@ def __add_to_cache(config, sec, key, fallback):
     """
     Stores a config value in cache
     """
-    config_cache[f'{sec}.{key}'] = config[sec].get(key, fallback)
+    # sections added in later versions may be missing in existing config files
+    config_cache[f'{sec}.{key}'] = config.get(sec, key, fallback=fallback)
@@ -0,0 +1,126 @@
+import logging
+import threading
+from datetime import timedelta
+from typing import Iterable, List, Optional
+
+import pandas as pd
+from sqlalchemy import Integer, cast, func, select
+from sqlalchemy.orm import Session
+
+import config
+from db.models import EtfHistory, EtfHistoryCoverage, EtfHistoryGap
+from price_cache import history_version, normalize_date_range
+
+
+def update_coverage(session: Session, isins: Optional[Iterable[str]] = None):
+    """
+    Recomputes the coverage and the largest gap of each year in the price history of the given ISINs, by default of all
+    ISINs, with grouped queries.
+
+    Importers pass the ISINs they have written, so only their history is scanned. If the coverage has never been
+    computed, e.g. in a database of an older version, it is computed for all ISINs. Must be called before
+    mark_history_changed, so processes reloading the coverage see the updated tables.
+    """
+    if isins is not None and session.query(EtfHistoryCoverage).first() is None:
+        isins = None
+    if isins is not None:
+        isins = list(isins)
+        if not isins:
+            return
+
+    gap = EtfHistory.datapoint_date - func.lag(EtfHistory.datapoint_date).over(partition_by=EtfHistory.isin,
+                                                                               order_by=EtfHistory.datapoint_date)
+    dates = select(EtfHistory.isin, EtfHistory.datapoint_date, gap.label('gap'))
+    coverage_rows = session.query(EtfHistoryCoverage)
+    gap_rows = session.query(EtfHistoryGap)
+    if isins is not None:
+        dates = dates.where(EtfHistory.isin.in_(isins))
+        coverage_rows = coverage_rows.filter(EtfHistoryCoverage.isin.in_(isins))
+        gap_rows = gap_rows.filter(EtfHistoryGap.isin.in_(isins))
+    dates = dates.subquery()
+    coverage = select(dates.c.isin, func.min(dates.c.datapoint_date), func.max(dates.c.datapoint_date),
+                      func.count(), func.coalesce(func.max(dates.c.gap), 0)).group_by(dates.c.isin)
+
+    year = cast(func.extract('year', dates.c.datapoint_date), Integer)
+    gaps = select(dates.c.isin, year, func.max(dates.c.gap)).where(dates.c.gap.isnot(None)).group_by(dates.c.isin, year)
+
+    coverage_rows.delete(synchronize_session=False)
+    updated = session.execute(EtfHistoryCoverage.__table__.insert().from_select(
+        ['isin', 'first_date', 'last_date', 'row_count', 'largest_gap'], coverage)).rowcount
+    gap_rows.delete(synchronize_session=False)
+    session.execute(EtfHistoryGap.__table__.insert().from_select(['isin', 'year', 'largest_gap'], gaps))
+    session.commit()
+    logging.info(f"Updated price history coverage of {updated} ISINs")
+
+
+class CoverageIndex:
+    """
+    An in-memory copy of the etf_history_coverage and etf_history_gap tables, reloaded whenever the price history
+    changes.
+    """
+
+    def __init__(self):
+        self.coverage = None
+        self.gaps = None
+        self.version = None
+        self.lock = threading.Lock()
+
+    def get(self, session: Session) -> pd.DataFrame:
+        """
+        Returns the coverage indexed by ISIN, which is empty if the table has not been computed yet
+        """
+        return self.__load(session)[0]
+
+    def get_gaps(self, session: Session) -> pd.DataFrame:
+        """
+        Returns the largest gap of each ISIN and year as columns isin, year and largest_gap
+        """
+        return self.__load(session)[1]
+
+    def __load(self, session):
+        version = history_version()
+        with self.lock:
+            if self.coverage is None or self.version != version:
+                query = session.query(EtfHistoryCoverage).statement
+                self.coverage = pd.read_sql(query, session.bind, index_col='isin',
+                                            parse_dates=['first_date', 'last_date'])
+                self.gaps = pd.read_sql(session.query(EtfHistoryGap).statement, session.bind)
+                self.version = version
+            return self.coverage, self.gaps
+
+
+coverage_index = CoverageIndex()
+
+
+def eligible_isins(session: Session, isins: List[str], start_date, end_date=None, buffer_days=10):
+    """
+    Returns the ISINs whose price history covers the date range, or None if no coverage is available.
+
+    An ISIN is eligible if its history starts at latest on start_date, reaches at least up to buffer_days before
+    end_date (defaults to start_date) and has no gap longer than the configured max_gap_days within the years of the
+    date range. Otherwise, it would cut off dates of the aligned price matrix. Gaps are known per year, hence a gap
+    ending in the year of start_date but before it rejects the ISIN as well. An end_date after the latest stored price
+    is moved back to that price.
+    """
+    coverage = coverage_index.get(session)
+    if coverage.empty:
+        return None
+
+    start_date, end_date = normalize_date_range(start_date, end_date or start_date)
+    max_gap = int(config.get_value('coverage', 'max_gap_days'))
+    end_date = min(pd.Timestamp(end_date), coverage['last_date'].max())
+
+    gaps = coverage_index.get_gaps(session)
+    gaps = gaps[gaps['year'].between(pd.Timestamp(start_date).year, end_date.year)]
+    candidates = coverage.loc[coverage.index.intersection(isins)]
+    largest_gap = gaps.groupby('isin')['largest_gap'].max().reindex(candidates.index).fillna(0)
+    mask = (candidates['first_date'] <= pd.Timestamp(start_date)) \
+           & (candidates['last_date'] >= end_date - timedelta(days=buffer_days)) \
+           & (largest_gap <= max_gap)
+
+    rejected = candidates.index[~mask & (largest_gap > max_gap)]
+    if len(rejected):
+        logging.info(f"Rejected {len(rejected)} ISINs with gaps of more than {max_gap} days in the price history "
+                     f"of the date range")
+
+    return candidates.index[mask].tolist()
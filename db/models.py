@@ -1,4 +1,4 @@
-from sqlalchemy import String, Date, Integer, Float, Boolean, ForeignKey, Column
+from sqlalchemy import String, Date, DateTime, Integer, BigInteger, Float, Boolean, ForeignKey, Column, Index
 
 from db.table_manager import Base
 
@@ -77,6 +77,10 @@ class Etf(Base):
     is_swap_based_etf = Column(Boolean)
     is_synthetic_replication = Column(Boolean)
 
+    # content hashes of the records last retrieved from extraetf.com, for skipping unchanged ETFs when recrawling
+    extraetf_list_hash = Column(String)
+    extraetf_detail_hash = Column(String)
+
 
 class EtfCategory(Base):
     """
@@ -98,6 +102,9 @@ class IsinCategory(Base):
     etf_isin = Column(String, ForeignKey('etf.isin'), primary_key=True)
     category_id = Column(Integer, ForeignKey('category.id'), primary_key=True)
 
+    # the primary key cannot serve lookups by category
+    __table_args__ = (Index('ix_isin_category_category_id', 'category_id'),)
+
 
 class EtfHistory(Base):
     """
@@ -109,3 +116,102 @@ class EtfHistory(Base):
     datapoint_date = Column(Date, primary_key=True)
 
     price = Column(Float)
+
+    # date range queries are answered from this index alone without visiting the table
+    __table_args__ = (Index('ix_etf_history_date_isin', 'datapoint_date', 'isin', postgresql_include=['price']),)
+
+
+class EtfHistoryCoverage(Base):
+    """
+    The table stores for each ETF which range of its price history is available.
+
+    It is derived from etf_history and updated by the history importers.
+    """
+    __tablename__ = 'etf_history_coverage'
+
+    isin = Column(String, primary_key=True)
+    first_date = Column(Date)
+    last_date = Column(Date)
+    row_count = Column(Integer)
+    # largest number of days between two consecutive prices
+    largest_gap = Column(Integer)
+
+
+class EtfHistoryGap(Base):
+    """
+    The table stores for each ETF and year the largest number of days between two consecutive prices ending in that year.
+
+    It is derived from etf_history and updated together with etf_history_coverage.
+    """
+    __tablename__ = 'etf_history_gap'
+
+    isin = Column(String, primary_key=True)
+    year = Column(Integer, primary_key=True)
+    largest_gap = Column(Integer)
+
+
+class HistoryVersion(Base):
+    """
+    The table stores a single row with a random version of the price history, which changes whenever it is modified.
+
+    Data derived from etf_history outside of database, e.g. the price panel and the caches, is tagged with the version
+    it was derived from, so it is never served for another state or another database.
+    """
+    __tablename__ = 'history_version'
+
+    id = Column(Integer, primary_key=True)
+    version = Column(BigInteger)
+    changed_at = Column(DateTime)
+
+
+class EtfSyncState(Base):
+    """
+    The table stores for each ETF up to which date its price history has been imported.
+
+    It is maintained by the history importers, so that only missing prices are requested.
+    """
+    __tablename__ = 'etf_sync_state'
+
+    isin = Column(String, primary_key=True)
+    last_date = Column(Date)
+    last_attempt = Column(DateTime)
+
+
+class EtfRic(Base):
+    """
+    The table stores for each ETF its RIC and which Refinitiv request returned its prices.
+
+    ISINs for which no request returned prices are skipped by imports for a while, see no_data_since.
+    """
+    __tablename__ = 'etf_ric'
+
+    isin = Column(String, primary_key=True)
+    ric = Column(String)
+    resolved_at = Column(DateTime)
+    # 'timeseries' or 'get_data'
+    data_path = Column(String)
+    no_data_since = Column(DateTime)
+
+
+class ImportRun(Base):
+    """
+    The table journals the history imports from Refinitiv, so that interrupted imports can be resumed.
+    """
+    __tablename__ = 'import_run'
+
+    id = Column(Integer, autoincrement=True, primary_key=True)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+
+class ImportRunItem(Base):
+    """
+    The table stores for each ISIN of an import run whether it has been imported and how many prices were written.
+    """
+    __tablename__ = 'import_run_item'
+
+    run_id = Column(Integer, ForeignKey('import_run.id'), primary_key=True)
+    isin = Column(String, primary_key=True)
+    # 'pending', 'done', 'no_data' or 'failed'
+    status = Column(String)
+    rows_written = Column(Integer)
@@ -1,3 +1,5 @@
+from sqlalchemy import inspect, text
+
 from db import Base
 
 
@@ -15,3 +17,32 @@ def drop_static_tables(engine):
     """
     from db.models import Etf, EtfCategory, IsinCategory
     Base.metadata.drop_all(bind=engine, tables=[Etf.__table__, IsinCategory.__table__, EtfCategory.__table__])
+
+
+def migrate(engine):
+    """
+    Brings an existing database up to date with the models by creating missing tables, columns and indexes.
+
+    Returns the names of the created columns and indexes.
+    """
+    import db.models  # registers all tables with the metadata
+    create_table(engine)
+
+    inspector = inspect(engine)
+    created = []
+    for table in Base.metadata.sorted_tables:
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=engine.dialect)
+                with engine.begin() as connection:
+                    connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                created.append(f'{table.name}.{column.name}')
+
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=engine)
+                created.append(index.name)
+
+    return created
@@ -1,147 +1,94 @@
-import logging
-from datetime import date, datetime
-from typing import List
+from datetime import date, timedelta
+from typing import Dict, List
 
 import eikon as ek
 
 import config
+from coverage import update_coverage
 from db import Session, sql_engine
-from db.models import EtfHistory, IsinCategory
+from db.models import IsinCategory
 from db.table_manager import create_table
+from history_fetcher import HistoryFetcher
+from history_provider import HistoryProvider, RefinitivProvider
+from history_writer import ImportStats, load_last_dates
+from import_journal import finish_run, load_unfinished_run, start_run
+from price_cache import mark_history_changed, history_version
+from price_panel import materialize_price_panel
 
 
-def save_history_api():
+def save_history_api(resume=False):
     """
     Retrieves price data from Refinitiv for all available ISINs and writes it to database.
+
+    Each import is journaled as a run. If resume is set, the ISINs of the last unfinished run which have not been
+    imported yet are retrieved instead.
     """
 
     create_table(sql_engine)
-    start_date = get_latest_date()
-    skipped_isins = get_timeseries(start_date)
-    get_data(start_date.replace('-', ''), skipped_isins)
+    start_dates = get_start_dates()
 
+    session = Session()
+    unfinished = load_unfinished_run(session) if resume else None
+    if unfinished is not None:
+        run_id, pending = unfinished
+        start_dates = {isin: start_dates[isin] for isin in pending if isin in start_dates}
+        print(f'Resuming import run {run_id} with {len(start_dates)} remaining ISINs')
+    else:
+        if resume:
+            print('There is no unfinished import run, starting a new one')
+        run_id = start_run(session, list(start_dates.keys()))
+    session.close()
 
-def get_timeseries(start_date):
-    """
-    Extracts historic price data consisting of timestamps and prices for all available ISINs from the start date to today
-    For some ISINs no data is available with the get_timeseries function (weird API behaviour)
-    """
-    __set_app_key()
-    create_table(sql_engine)
-    isins = __get_isins()
-    skipped_isins = __get_isins()
-
-    for i in range(0, len(isins)):
-        session = Session()
-
-        try:
-            ric = ek.get_data(isins[i], ['TR.LipperRICCode'])[0].values[0][1]
-            if isinstance(ric, str):
-                today = (date.today()).strftime('%Y-%m-%d')
-                data = ek.get_timeseries(ric, fields=['TIMESTAMP', 'VALUE'], start_date=start_date, end_date=today,
-                                         interval='daily')
-                for j in range(0, len(data.values)):
-                    isin = isins[i]
-                    datapoint_date = data.axes[0][j].date()
-                    price = data.values[j][0]
-                    __write_history_value(isin, datapoint_date, price, session)
-
-                skipped_isins.remove(isins[i])
-                print('Finished writing get_timeseries values for ' + isins[i])
-            else:
-                logging.warning(f'No get_timeseries data available for ' + isins[i])
-
-        except KeyboardInterrupt:
-            session.rollback()
-            exit(0)
-        except:
-            # For some ISINs no data is available with the get_timeseries function
-            session.rollback()
-            logging.warning(f'No get_timeseries data available for ' + isins[i])
-
-        session.close()
-
-    return skipped_isins
-
-
-def get_data(start_date, skipped_isins):
-    """
-    Extracts historic price data consisting of timestamps and prices for all available ISINs from the start date until today
-    For some ISINs no data is available with the get_timeseries function (weird API behaviour)
-    """
     __set_app_key()
-    create_table(sql_engine)
-
-    for i in range(0, len(skipped_isins)):
-        session = Session()
-
-        try:
-            today = date.today().strftime('%Y%m%d')
-            data = ek.get_data(skipped_isins[i], ['TR.CLOSEPRICE.date', 'TR.CLOSEPRICE'],
-                               parameters={'SDate': start_date, 'EDate': today, 'Frq': 'D'})
-            for value in data[0].values:
-                insert = True
-                if isinstance(value[2], float):
-                    isin = skipped_isins[i]
-                    datapoint_date = datetime.strptime(value[1][0:10], '%Y-%m-%d').date()
-                    price = value[2]
-                else:
-                    insert = False
-
-                if insert:
-                    __write_history_value(isin, datapoint_date, price, session)
 
-            print('Finished writing get_data values for ' + skipped_isins[i])
-
-        except KeyboardInterrupt:
-            session.rollback()
-            exit(0)
-        except:
-            # For some ISINs no data is available with the get_data function
-            session.rollback()
-            logging.warning(f'No get_data values available for ' + skipped_isins[i])
+    stats = ImportStats()
+    fetcher = create_fetcher(RefinitivProvider(ek, float(config.get_value('history-import', 'requests_per_second'))))
+    try:
+        fetcher.run(start_dates, stats, run_id)
+    except KeyboardInterrupt:
+        print('Import interrupted, continue it with: etfopt import-history --resume')
+        exit(0)
+    print(stats.report())
 
-        session.close()
+    session = Session()
+    if not finish_run(session, run_id):
+        print('Some ISINs could not be saved, retry them with: etfopt import-history --resume')
+    update_coverage(session, stats.isins)
+    mark_history_changed()
+    materialize_price_panel(session, history_version())
+    session.close()
 
 
-def get_latest_date():
+def create_fetcher(provider: HistoryProvider) -> HistoryFetcher:
     """
-    Sets the start date to 01.01.1990 or the most recent date for which data has already been extracted
+    Creates a fetcher retrieving prices from the provider with the configured concurrency and retries
     """
-    start_date = date(1990, 1, 1)
+    return HistoryFetcher(provider.resolve_rics, provider.fetch_prices,
+                          int(config.get_value('history-import', 'workers')),
+                          int(config.get_value('history-import', 'ric_batch_size')),
+                          timedelta(days=float(config.get_value('history-import', 'no_data_ttl_days'))),
+                          int(config.get_value('history-import', 'retries')),
+                          float(config.get_value('history-import', 'retry_backoff')))
 
-    session = Session()
-    for datapoint_date in session.query(EtfHistory.datapoint_date).distinct():
-        if start_date < datapoint_date._data[0]:
-            start_date = datapoint_date._data[0]
-
-    return str(start_date)
 
+def get_start_dates() -> Dict[str, date]:
+    """
+    Returns for each ISIN the first date without stored price data, 01.01.1990 if none has been extracted yet.
 
-def __get_isins() -> List[str]:
+    ISINs which are already up to date are left out.
+    """
     session = Session()
-    return session.query(IsinCategory.etf_isin).distinct().all()
+    last_dates = load_last_dates(session)
+    isins = __get_isins(session)
+    session.close()
 
+    start_dates = {isin: last_dates[isin] + timedelta(days=1) if isin in last_dates else date(1990, 1, 1)
+                   for isin in isins}
+    return {isin: start_date for isin, start_date in start_dates.items() if start_date <= date.today()}
 
-def __write_history_value(isin, date, price, session):
-    """
-    Write the extracted values to the database
-    """
-    try:
-        res: EtfHistory = session.query(EtfHistory).filter_by(isin=isin, datapoint_date=date).first()
-        if res is None:
-            data = EtfHistory()
-
-            data.isin = isin
-            data.datapoint_date = date
-            data.price = price
-
-            session.add(data)
-            session.commit()
-    except:
-        logging.warning(f'Could not save data')
-        session.rollback()
-        raise
+
+def __get_isins(session) -> List[str]:
+    return [isin for (isin,) in session.query(IsinCategory.etf_isin).distinct()]
 
 
 def __set_app_key():
@@ -1,13 +1,19 @@
 import csv
 import logging
+import os
 import sys
-from datetime import datetime
+from itertools import islice
 
+import openpyxl
 import pandas
 
+import config
+from coverage import update_coverage
 from db import Session, sql_engine
-from db.models import EtfHistory
 from db.table_manager import create_table
+from history_writer import ImportStats, write_prices
+from price_cache import mark_history_changed, history_version
+from price_panel import materialize_price_panel
 
 
 def save_history_excel(historypath, isinpath):
@@ -16,25 +22,53 @@ def save_history_excel(historypath, isinpath):
     """
     create_table(sql_engine)
     session = Session()
-    write_history_to_db(historypath, isinpath, session)
+    stats = write_history_to_db(historypath, isinpath, session)
+    update_coverage(session, stats.isins)
+    mark_history_changed()
+    materialize_price_panel(session, history_version())
     session.close()
 
 
 def write_history_to_db(historypath, isinpath, session):
     """
     Combines the retrieved ISIN and price data and writes it to the database
+
+    The history file is processed in chunks of rows, each chunk is written within one transaction. Returns the
+    statistics of the written prices.
     """
     isin_dict = __get_isin_dict(isinpath)
-    etf_history, header = __get_history_data(historypath)
+    stats = ImportStats()
+
+    for chunk in __get_history_chunks(historypath, int(config.get_value('history-import', 'chunk_size'))):
+        # every third column holds the prices of an ETF, the first column holds the dates
+        prices = chunk.iloc[:, [0] + list(range(1, len(chunk.columns), 3))]
+        prices = prices.melt(id_vars=prices.columns[0], var_name='name', value_name='price')
+
+        prices['isin'] = prices['name'].map(isin_dict)
+        unknown = prices.loc[prices['isin'].isna(), 'name'].unique()
+        if len(unknown):
+            logging.warning(f"Skipping history of {', '.join(map(str, unknown))} without ISIN in {isinpath}")
+
+        prices['datapoint_date'] = __parse_dates(prices.iloc[:, 0])
+        prices['price'] = pandas.to_numeric(prices['price'], errors='coerce')
+        prices = prices.dropna(subset=['isin', 'price'])
 
-    for i in range(0, len(etf_history)):
-        datapoint_date = datetime.strptime(etf_history.iloc[i, 0], '%d.%m.%Y').date()
+        # allow re-imports of data, as nothing speaks against it, as this is useful in the following scenario:
+        # refintiv has changed its history prices/revenue for some entries as they were wrong (very unlikely)
+        # but this way we have also covered this scenario
+        write_prices(session, prices, stats, overwrite=True)
 
-        for j in range(1, len(etf_history.columns), 3):
-            isin = isin_dict[header[j]]
-            price = float(etf_history.iloc[i, j])
+    print(stats.report())
+    return stats
 
-            __write_history_value(datapoint_date, isin, price, session)
+
+def __parse_dates(dates: pandas.Series) -> pandas.Series:
+    """
+    Converts the dates of csv files (dd.mm.yyyy) or date cells of xlsx files to dates
+    """
+    if not pandas.api.types.is_datetime64_any_dtype(dates):
+        dates = pandas.to_datetime(dates, format='%d.%m.%Y')
+    return dates.dt.date
 
 
 def __get_isin_dict(isinpath):
@@ -56,43 +90,32 @@ def __get_isin_dict(isinpath):
     return isin_dict
 
 
-def __get_history_data(historypath):
+def __get_history_chunks(historypath, chunk_size):
     """
-    Reads the extraxted price data from historypath file
+    Reads the extracted price data from historypath file (csv or xlsx) in chunks of chunk_size rows
     """
-    try:
-        etf_history = pandas.read_csv(historypath, sep=';')
-        header = etf_history.columns.to_list()
-    except:
+    if not os.path.isfile(historypath):
         print(f"File {historypath} was not found at the given location.\n")
         sys.exit(1)
-    return etf_history, header
+
+    if historypath.endswith('.xlsx'):
+        yield from __get_excel_chunks(historypath, chunk_size)
+    else:
+        yield from pandas.read_csv(historypath, sep=';', chunksize=chunk_size)
 
 
-def __write_history_value(datapoint_date, isin, price, session):
+def __get_excel_chunks(historypath, chunk_size):
     """
-    Write the extracted values to the database
+    Streams the rows of the first worksheet without loading the whole workbook into memory
     """
+    workbook = openpyxl.load_workbook(historypath, read_only=True)
     try:
-        res: EtfHistory = session.query(EtfHistory).filter_by(isin=isin, datapoint_date=datapoint_date).first()
-        if res is not None:
-            # allow re-imports of data, as nothing speaks against it, as this is useful in the following scenario:
-            # refintiv has changed its history prices/revenue for some entries as they were wrong (very unlikely)
-            # but this way we have also covered this scenario
-            res.price = price
-
-            logging.warning(f"Overwriting history for ETF '{isin}'. Did you re-import this data?")
-        else:
-            data = EtfHistory()
-
-            data.isin = isin
-            data.datapoint_date = datapoint_date
-
-            data.price = price
-
-            session.add(data)
-            session.commit()
-    except:
-        logging.warning(f'Could not save data!')
-        session.rollback()
-        raise
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows)
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            yield pandas.DataFrame.from_records(chunk, columns=header)
+    finally:
+        workbook.close()
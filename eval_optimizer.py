@@ -1,7 +1,6 @@
 from datetime import date
 
 import dash_html_components as html
-import numpy as np
 import pandas as pd
 import plotly.express as px
 import yfinance as yf
@@ -11,8 +10,9 @@ from dateutil.relativedelta import relativedelta
 from db import Session
 from db.models import Etf
 from frontend.app import create_app, prepare_hist_data, get_isins_from_filters, preprocess_isin_price_data, \
-    create_figure
+    create_figure, portfolio_value
 from optimizer import ReturnRiskModel, PortfolioOptimizer, Optimizer
+from price_cache import get_price_matrix
 
 
 def main():
@@ -39,19 +39,17 @@ def main():
     last_day = date(2021, 5, 31)
     first_day = last_day - relativedelta(years=total_years)
     msci_hist = msci_world.history(start=first_day, end=last_day)
-    msci_hist = msci_hist.drop(columns=['Low', 'High', 'Volume', 'Dividends', 'Open', 'Stock Splits'])
 
-    price_on_first_day = msci_hist['Close'].values[0]
-    shares = total_portfolio_value / price_on_first_day  # do not display rest
-    msci_hist['Close'] = np.where(True, msci_hist['Close'] * shares, msci_hist['Close'])
+    msci_hist = portfolio_value(msci_hist[['Close']], pd.Series({'Close': total_portfolio_value}))  # do not display rest
     msci_hist['Name'] = 'iShares MSCI World Index ETF'
-    msci_hist.reset_index(inplace=True)
-    msci_hist = msci_hist.rename(columns={"Close": "Wert", "Date" : "Datum"})
     msci_hist['Datum'] = msci_hist['Datum'].apply(lambda x: str(x).split(" ")[0])
 
     figures = []
     price_dfs = []
 
+    # load the prices of all windows at once, each window is then sliced from the cached matrix
+    get_price_matrix(session, isins, last_day - relativedelta(years=total_years + period_length_in_years), last_day)
+
     for years in range(total_years, -1, -1):
         start_date = last_day - relativedelta(years=years + period_length_in_years)
         end_date = start_date + relativedelta(years=period_length_in_years)
@@ -59,7 +57,7 @@ def main():
         if end_date_invest > last_day:
             break
 
-        preprocessed_isin = preprocess_isin_price_data(isins, session, start_date)
+        preprocessed_isin = preprocess_isin_price_data(isins, session, start_date, end_date)
         opt_hist = PortfolioOptimizer(preprocessed_isin, start_date, end_date, session, ReturnRiskModel.MEAN_VARIANCE)
         opt_hist.prepare_optmizer()
         prices = prepare_hist_data(Optimizer.MAX_SHARPE, etf_names, opt_hist, total_portfolio_value, cutoff,
@@ -1,22 +1,52 @@
-import time
+import asyncio
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+
 import click
+import httpx
+from sqlalchemy.dialects.postgresql import insert
 
-import requests
-from sqlalchemy.exc import IntegrityError
+import config
 
 from db import sql_engine, Session
 from db.models import EtfCategory, IsinCategory, Etf
 from db.table_manager import create_table
+from http_cache import REPLAY, CachingTransport, ResponseStore
+from rate_limit import TokenBucket
 from scraping.items import EtfItem, string_to_date
 
+# fields of the list page records which change daily and are left out of their content hash
+VOLATILE_LIST_FIELDS = ('assets_under_management',)
+
+# we only update attributes of existing ETFs that do not exist at justetf.com or are of higher precision at extraetf.com
+UPDATED_COLUMNS = ('fund_size', 'ter', 'tax_germany', 'net_assets_currency', 'is_accumulating', 'is_derivative_based',
+                   'is_distributing', 'is_etc', 'is_etf', 'is_hedged', 'hedged_currency', 'is_index_fund',
+                   'is_leveraged', 'is_physical_full', 'is_short', 'is_socially_responsible_fund', 'is_structured',
+                   'is_swap_based_etf', 'is_synthetic_replication', 'extraetf_list_hash', 'extraetf_detail_hash')
+
+
+def content_hash(record: dict, exclude=()) -> str:
+    """
+    Returns a hash of the record's fields, independent of their order
+    """
+    content = {key: value for key, value in record.items() if key not in exclude}
+    return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
 
 class Extraetf():
     """
     This class extracts ETF data from extraetf.com via an undocumented API. As such an API is always subject to change
     we must expect this implementation to work only for a limited amount of time.
+
+    The content hashes of the list page record and the detail record of each ETF are stored. Unless a full crawl is
+    requested, the detail page of an ETF whose list page record has not changed since the last crawl is not requested
+    and only its fund size is updated. The ETFs of each list page are written within one transaction.
+
+    If an HTTP cache mode is given, responses are recorded on disk or replayed from there without rate limit.
     """
 
-    def __init__(self):
+    def __init__(self, full=False, http_cache=None):
         # the category names on extraetf.com
         self.category_types = {'sector_name': 'Sektor', 'land_name': 'Land', 'region_name': 'Region',
                                'asset_class_name': "Asset Klasse", 'strategy_name': 'Strategie',
@@ -26,48 +56,172 @@ class Extraetf():
                                'bond_rating_name': 'Rating'}
         create_table(sql_engine)
         self.session = Session()
-        self.cgry_cache = dict()
+        # category ids by (type, name)
+        self.cgry_cache = {(cat_type, cat_name): cat_id for cat_id, cat_type, cat_name in
+                           self.session.query(EtfCategory.id, EtfCategory.type, EtfCategory.name)}
+
+        self.full = full
+        self.known = {isin: (list_hash, detail_hash, fund_size) for isin, list_hash, detail_hash, fund_size in
+                      self.session.query(Etf.isin, Etf.extraetf_list_hash, Etf.extraetf_detail_hash, Etf.fund_size)}
+        self.skipped = 0
+
+        self.concurrency = int(config.get_value('extraetf', 'concurrency'))
+        self.retries = int(config.get_value('extraetf', 'retries'))
+        self.backoff = float(config.get_value('extraetf', 'retry_backoff'))
+        self.bucket = TokenBucket(float(config.get_value('extraetf', 'requests_per_second')))
+        self.http_cache = http_cache
 
     def collect_data(self):
+        asyncio.run(self.__crawl())
+        self.session.close()
+
+    async def __crawl(self):
+        """
+        Fetches all list pages and the detail page of each ETF on them.
+
+        Detail pages are fetched concurrently by a pooled keep-alive client, while a single writer stores the results.
+        """
         offset = 0
         limit = 200
 
-        while True:
-            params = {'offset': offset, 'limit': limit, 'ordering': '-assets_under_management', 'leverage_from': 1,
-                      'leverage_to': 1}
-            response = requests.get('https://de.extraetf.com/api-v2/search/full/', params=params)
-            time.sleep(2)
+        results = asyncio.Queue(maxsize=2)
+        writer = asyncio.create_task(self.__write(results))
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        transport = httpx.AsyncHTTPTransport(limits=limits)
+        if self.http_cache is not None:
+            transport = CachingTransport(ResponseStore(), self.http_cache, transport)
 
-            data = response.json()
-            page = int(offset / limit + 1)
-            results = data['results']
-            click.echo(f"Extracted etfs from page {page}!")
-            self.__parse_page(results)
+        try:
+            async with httpx.AsyncClient(base_url='https://de.extraetf.com', transport=transport, timeout=30) as client:
+                while True:
+                    params = {'offset': offset, 'limit': limit, 'ordering': '-assets_under_management',
+                              'leverage_from': 1, 'leverage_to': 1}
+                    data = await self.__get_json(client, '/api-v2/search/full/', params)
+
+                    page = int(offset / limit + 1)
+                    click.echo(f"Extracted etfs from page {page}!")
+                    entries = await self.__parse_page(client, data['results'])
+                    await self.__put(results, entries, writer)
+
+                    if data['next'] is None:
+                        break
+
+                    offset += limit
+        finally:
+            if writer.done():
+                writer.result()  # raises the error of a failed writer
+            else:
+                await self.__put(results, None, writer)
+                await writer
 
-            if data['next'] is None:
-                break
+        if self.skipped:
+            click.echo(f"Skipped details of {self.skipped} unchanged ETFs")
 
-            offset += limit
+    async def __parse_page(self, client, results):
+        """
+        Extracts the data from each detail page displayed on a page from extraetf.com
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
 
-        self.session.close()
+        async def fetch_detail(result):
+            list_hash = content_hash(result, exclude=VOLATILE_LIST_FIELDS)
+            known = self.known.get(result['isin'])
+            if not self.full and known is not None and known[0] == list_hash:
+                self.skipped += 1
+                return (result, None) if known[2] != result['assets_under_management'] else None
 
-    def __parse_page(self, results):
+            async with semaphore:
+                try:
+                    detail = await self.__get_json(client, '/api-v2/detail/', {'isin': result['isin']})
+                except httpx.HTTPError as e:
+                    click.echo(f"Could not retrieve details for {result['isin']}: {e}")
+                    return None
+            return result, detail['results'][0]
+
+        entries = await asyncio.gather(*(fetch_detail(result) for result in results))
+        return [entry for entry in entries if entry is not None]
+
+    @staticmethod
+    async def __put(queue, entries, writer):
         """
-        Parses and stores a page from extraetf.com and extracts the data from each detail page displayed on that page.
+        Queues the entries for the writer, raises the error of the writer if it fails instead of waiting for it forever
         """
+        put = asyncio.ensure_future(queue.put(entries))
+        await asyncio.wait({put, writer}, return_when=asyncio.FIRST_COMPLETED)
+        if not put.done():
+            put.cancel()
+            writer.result()
+
+    async def __get_json(self, client, url, params):
+        """
+        Requests the url within the rate limit and retries with exponential backoff if the server is busy or failing
+        """
+        for attempt in range(self.retries + 1):
+            if self.http_cache != REPLAY:
+                await self.bucket.acquire_async()
+            delay = self.backoff * 2 ** attempt
+            try:
+                response = await client.get(url, params=params)
+            except httpx.TransportError:
+                if attempt == self.retries:
+                    raise
+            else:
+                if response.status_code != 429 and response.status_code < 500:
+                    response.raise_for_status()
+                    return response.json()
+                if attempt == self.retries:
+                    response.raise_for_status()
 
-        for result in results:
-            detail_params = {'isin': result['isin']}
-            detail_response = requests.get('https://de.extraetf.com/api-v2/detail/', detail_params)
-            detail_result = detail_response.json()['results'][0]
+                retry_after = response.headers.get('Retry-After', '')
+                if retry_after.isdigit():
+                    delay = float(retry_after)
+
+            await asyncio.sleep(delay)
+
+    async def __write(self, queue):
+        """
+        Parses and stores the queued pages on a separate thread, so database writes do not block fetching
+        """
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(max_workers=1) as db_executor:
+            while True:
+                entries = await queue.get()
+                if entries is None:
+                    break
+                await loop.run_in_executor(db_executor, self.__store, entries)
+
+    def __store(self, entries):
+        """
+        Stores the ETFs of one page and their categories within one transaction
+        """
+        etfs = {}
+        fund_sizes = []
+        categories = []
+        for result, detail_result in entries:
+            if detail_result is None:
+                fund_sizes.append({'isin': result['isin'], 'fund_size': result['assets_under_management']})
+                continue
 
             item = self.__parse_item(result, detail_result)
             item = self.__process_item(item)
-            self.__save_item(item)
+            detail_hash = content_hash(detail_result)
+            etfs[result['isin']] = self.__to_row(item, content_hash(result, exclude=VOLATILE_LIST_FIELDS), detail_hash)
 
-            self.save_item_categories(result, detail_result)
+            known = self.known.get(result['isin'])
+            if self.full or known is None or known[1] != detail_hash:
+                categories += [(result['isin'], cat_type, detail_result[cat_key])
+                               for cat_key, cat_type in self.category_types.items() if detail_result[cat_key]]
 
-            time.sleep(0.25)  # slow down to avoid getting banned :)
+        try:
+            self.__save_items(list(etfs.values()))
+            if fund_sizes:
+                self.session.bulk_update_mappings(Etf, fund_sizes)
+            self.__save_item_categories(categories)
+            self.session.commit()
+        except:
+            click.echo(f"Could not save data for {', '.join(etfs)}!")
+            self.session.rollback()
+            raise
 
     def __parse_item(self, result, detail_result):
         """
@@ -143,104 +297,40 @@ class Extraetf():
 
         return item
 
-    def __save_item(self, item: EtfItem):
+    @staticmethod
+    def __to_row(item: EtfItem, list_hash, detail_hash):
         etf = item.to_etfitemdb()
-        try:
-            current_data: Etf = self.session.query(Etf).filter_by(isin=etf.isin).first()
-            if current_data is not None:
-                click.echo(f"Updating existing ETF {current_data.isin}")
-                self.__update_item(current_data, etf)
-
-            else:
-                self.session.add(etf)
-                self.session.commit()
-        except:
-            click.echo(f"Could not save data for {etf.isin}!")
-            self.session.rollback()
-            raise
-
-    def __update_item(self, current_data, etf):
-        """
-        Overwrites certain ETF data from justetf if a particular ETF is included in both databases
-        """
-
-        # we only update attributes that do not exist at justetf.com or are of higher precision at extraetf.com
-        # higher precision
-        current_data.fund_size = etf.fund_size
-        current_data.ter = etf.ter
-        # new
-        current_data.tax_germany = etf.tax_germany
-        current_data.net_assets_currency = etf.net_assets_currency
-        current_data.is_accumulating = etf.is_accumulating
-        current_data.is_derivative_based = etf.is_derivative_based
-        current_data.is_distributing = etf.is_distributing
-        current_data.is_etc = etf.is_etc
-        current_data.is_etf = etf.is_etf
-        current_data.is_hedged = etf.is_hedged
-        current_data.hedged_currency = etf.hedged_currency
-        current_data.is_index_fund = etf.is_index_fund
-        current_data.is_leveraged = etf.is_leveraged
-        current_data.is_physical_full = etf.is_physical_full
-        current_data.is_short = etf.is_short
-        current_data.is_socially_responsible_fund = etf.is_socially_responsible_fund
-        current_data.is_structured = etf.is_structured
-        current_data.is_swap_based_etf = etf.is_swap_based_etf
-        current_data.is_synthetic_replication = etf.is_synthetic_replication
-        self.session.commit()
-
-    def save_item_categories(self, result, detail_result):
-        """
-        Saves the item category for each item
-        """
-        isin = result['isin']
-        categories = [(detail_result[cat_key], cat_type) for cat_key, cat_type in self.category_types.items()]
-
-        try:
-            for cat_name, cat_type in categories:
-                self.__save_item_category(cat_name, cat_type, isin)
-
-        except:
-            click.echo(f"Could not save data for {result['isin']}!")
-            self.session.rollback()
-            raise
+        etf.extraetf_list_hash = list_hash
+        etf.extraetf_detail_hash = detail_hash
+        return {column.name: getattr(etf, column.name) for column in Etf.__table__.columns}
 
-    def __save_item_category(self, cat_name, cat_type, isin):
+    def __save_items(self, rows):
         """
-        Saves the category if it is a previously unknown category and associates a particular ISIN with that category in the database.
+        Inserts new ETFs and overwrites certain data of ETFs already stored, e.g. from justetf
         """
+        if not rows:
+            return
 
-        if cat_name is not None and cat_name:
-            if cat_name in self.cgry_cache:
-                # if category has already been added to db we can use the cache to retrieve its id
-                cat_id = self.cgry_cache[cat_name]
-            else:
-                cat_id = self.__add_category(cat_name, cat_type)
-            if cat_id:
-                ic = IsinCategory()
-                ic.etf_isin = isin
-                ic.category_id = cat_id
-
-                try:
-                    self.session.add(ic)
-                    self.session.commit()
-                except IntegrityError:
-                    click.echo(f"Could not insert category data for ETF with ISIN {isin} and category {cat_name} "
-                                    f"as it already exists!")
-                    self.session.rollback()
-
-            else:
-                click.echo(f"No ID was found for item with category {cat_name}")
+        statement = insert(Etf).values(rows)
+        statement = statement.on_conflict_do_update(index_elements=['isin'], set_={
+            column: statement.excluded[column] for column in UPDATED_COLUMNS})
+        self.session.execute(statement)
 
-    def __add_category(self, cat_name, cat_type):
+    def __save_item_categories(self, categories):
         """
-        Stores a new category in database
+        Associates the ISINs with their categories, given as (isin, type, name), and stores previously unknown categories
         """
-        etf_category = EtfCategory()
-        etf_category.name = cat_name
-        etf_category.type = cat_type
-        self.session.add(etf_category)
-        self.session.commit()
-        self.session.refresh(etf_category)  # refresh to get auto-incremented cat_id
-        cat_id = etf_category.id
-        self.cgry_cache[cat_name] = cat_id
-        return cat_id
+        new_categories = {}
+        for _, cat_type, cat_name in categories:
+            if (cat_type, cat_name) not in self.cgry_cache and (cat_type, cat_name) not in new_categories:
+                new_categories[(cat_type, cat_name)] = EtfCategory(type=cat_type, name=cat_name)
+
+        if new_categories:
+            self.session.add_all(new_categories.values())
+            self.session.flush()  # flush to get the auto-incremented ids
+            self.cgry_cache.update({key: category.id for key, category in new_categories.items()})
+
+        rows = {(isin, self.cgry_cache[(cat_type, cat_name)]) for isin, cat_type, cat_name in categories}
+        if rows:
+            statement = insert(IsinCategory).values([{'etf_isin': isin, 'category_id': cat_id} for isin, cat_id in rows])
+            self.session.execute(statement.on_conflict_do_nothing(index_elements=['etf_isin', 'category_id']))
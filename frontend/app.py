@@ -14,13 +14,24 @@ from dateutil.relativedelta import relativedelta
 from sqlalchemy import and_
 
 import config
+from coverage import eligible_isins
 from db import Session, sql_engine
 from db.models import Etf, EtfCategory, EtfHistory, IsinCategory
 from db.table_manager import create_table
+from frontend import jobs
+from frontend.jobs import JobManager, report_progress
 from frontend.plotting import plot_efficient_frontier
 from optimizer import PortfolioOptimizer, ReturnRiskModel, Optimizer
+from price_cache import history_version, normalize_date_range
+from price_panel import load_price_panel
+from result_cache import make_key, result_cache
 
 app = dash.Dash(__name__)
+job_manager = JobManager(int(config.get_value('background-jobs', 'workers')),
+                         float(config.get_value('background-jobs', 'max_age')))
+# config sections changing the optimization results, cached results are only served for the same values
+result_config_sections = ['allocation', 'coverage', 'optimizer-defaults']
+job_progress_style = {'padding-top': 10, 'padding-bottom': 10, 'padding-left': 25, 'padding-right': 25}
 category_types = ['Asset Klasse', 'Anlageart', 'Region', 'Land', 'Währung', 'Sektor', 'Rohstoffklasse', 'Strategie',
                   'Laufzeit', 'Rating']
 
@@ -172,7 +183,8 @@ def create_performance_info():
             create_perf_row("er", "", "Erwartete jährliche Rendite: "),
             create_perf_row("vol", "", "Jährliche Volatilität: "),
             create_perf_row("ms", "", "Sharpe Ratio: "),
-            create_perf_row("ir", "", "Investitionsrestbetrag (€): ")
+            create_perf_row("ir", "", "Investitionsrestbetrag (€): "),
+            create_perf_row("al", "", "Allokationsverfahren: ")
         ], style={'padding-top': 20, 'padding-bottom': 20, 'padding-left': 25, 'padding-right': 25}),
     ],
         id="pp_info",
@@ -199,6 +211,24 @@ def create_data_table(table_id, table_data, width):
     return table
 
 
+def create_job_progress():
+    """
+    Creates a progress bar and a cancel button for optimizations running in the background
+    """
+    job_progress = html.Div([
+        dbc.Progress(id='opt_progress', value=0, striped=True, animated=True, style={'height': '25px'}),
+        html.Div(
+            dbc.Button('Abbrechen', id='Cancel Button', color='secondary', n_clicks=0),
+            style={'padding-top': 10}),
+        dcc.Interval(id='job_interval', interval=500, disabled=True),
+        dcc.Store(id='job_store'),
+    ],
+        id='job_progress',
+        style={**job_progress_style, 'display': 'none'})
+
+    return job_progress
+
+
 def create_navbar():
     """
     Creates a navigation bar without navigation options just for optical purposes
@@ -365,6 +395,7 @@ def create_app(app):
                        'padding-right': 25}
             ),
             create_button('Optimize', 'Optimiere'),
+            create_job_progress(),
             html.Div(dbc.Alert(id='opt_error', is_open=False, fade=True, color='danger'),
                      style={'display': 'inline-block', 'padding-top': 10, 'padding-bottom': 10, 'padding-left': 25,
                             'padding-right': 25})],
@@ -467,13 +498,21 @@ def validate_number(betrag, zinssatz, cutoff, target_return, target_risk):
      Output('pp_vol_value', 'children'),
      Output('pp_ms_value', 'children'),
      Output('pp_ir_value', 'children'),
+     Output('pp_al_value', 'children'),
      Output('all_table', 'data'),
      Output('all_pie_figure', 'figure'),
      Output('ef_figure', 'figure'),
      Output('historical_figure', 'figure'),
      Output('opt_error', 'children'),
-     Output('opt_error', 'is_open')],
-    [Input('Optimize Button', 'n_clicks')],
+     Output('opt_error', 'is_open'),
+     Output('job_progress', 'style'),
+     Output('opt_progress', 'value'),
+     Output('opt_progress', 'children'),
+     Output('job_interval', 'disabled'),
+     Output('job_store', 'data')],
+    [Input('Optimize Button', 'n_clicks'),
+     Input('job_interval', 'n_intervals'),
+     Input('Cancel Button', 'n_clicks')],
     state=[State(((cat_type.replace(' ', '')).lower()).capitalize() + ' Dropdown', 'value') for cat_type in
            category_types] +
           [State('Zusätzliche ISINs Dropdown', 'value'),
@@ -485,20 +524,75 @@ def validate_number(betrag, zinssatz, cutoff, target_return, target_risk):
            State('Zielrisiko Input Field', 'value'),
            State('Cutoff Input Field', 'value'),
            State('Historic Performance Checklist', 'checked'),
-           State('Allocation Algorithm', 'checked')],
+           State('Allocation Algorithm', 'checked'),
+           State('job_store', 'data')],
     prevent_initial_call=True
 )
-def update_output(num_clicks, assetklasse, anlageart, region, land, währung, sektor, rohstoffklasse, strategie,
+def handle_optimize(num_clicks, num_intervals, num_cancel_clicks, *args):
+    """
+    Responsible for starting, polling and cancelling optimizations when "Optimieren" button is pressed.
+
+    If background jobs are enabled, the optimization runs in a worker process and its progress is polled by an
+    interval. Otherwise the optimization runs within the request.
+    """
+    *inputs, job_id = args
+    trigger = dash.callback_context.triggered[0]['prop_id'].split('.')[0]
+    show_progress = {**job_progress_style, 'display': 'block'}
+    hide_progress = {**job_progress_style, 'display': 'none'}
+    unchanged = [dash.no_update] * 12
+
+    if trigger == 'job_interval':
+        if job_id is None:
+            return unchanged + [hide_progress, 0, '', True, None]
+
+        status = job_manager.status(job_id)
+        if not status.finished:
+            return unchanged + [show_progress, status.progress, status.stage, False, job_id]
+
+        job_manager.remove(job_id)
+        if status.state == jobs.DONE:
+            result = status.result
+        elif status.state == jobs.CANCELLED:
+            result = error_output('Die Optimierung wurde abgebrochen')
+        else:
+            result = error_output(f'Während der Optimierung ist ein Fehler aufgetreten: "{status.error}"')
+        return result + [hide_progress, 100, '', True, None]
+
+    if trigger == 'Cancel Button':
+        if job_id is not None:
+            job_manager.cancel(job_id)
+        return unchanged + [show_progress, dash.no_update, 'Wird abgebrochen', False, job_id]
+
+    # a new optimization supersedes a still running one
+    if job_id is not None:
+        job_manager.cancel(job_id)
+
+    if not background_jobs_enabled():
+        return update_output(*inputs) + [hide_progress, 100, '', True, None]
+
+    # invalid inputs and cached results are answered immediately
+    result = update_output(*inputs, cached_only=True)
+    if result is not None:
+        return result + [hide_progress, 100, '', True, None]
+
+    job_id = job_manager.submit(update_output, *inputs)
+    return unchanged + [show_progress, 0, 'In Warteschlange', False, job_id]
+
+
+def update_output(assetklasse, anlageart, region, land, währung, sektor, rohstoffklasse, strategie,
                   laufzeit, rating, extra_isins, rr_model, opt_method, betrag, zinssatz,
-                  target_return, target_risk, cutoff, create_hist_perf, alloc_algorithm):
+                  target_return, target_risk, cutoff, create_hist_perf, alloc_algorithm, job_id=None,
+                  cached_only=False):
     """
-    Responsible for updating the UI when "Optimieren" button is pressed.
+    Runs the optimization for the inputs of the UI.
 
-    Takes all category/ISIN dropdowns and input fields as parameters and updates a various fields with error messages or
-    contents showing the results of the optimization in a visual and data-centric way.
+    Takes all category/ISIN dropdowns and input fields as parameters and returns the values for various fields with
+    error messages or contents showing the results of the optimization in a visual and data-centric way.
+    When run as a background job, the progress is reported for each stage. If cached_only is set, None is returned
+    instead of running the optimization if the result is not cached.
     """
 
-    show_error = [{'display': 'none'}, '', '', '', '', None, {}, {}, {}, '', True]
+    show_error = error_output('')
     rounding = int(config.get_value('optimizer-defaults', 'rounding'))
 
     # 0. Step: Check if inputs are valid
@@ -525,55 +619,99 @@ def update_output(num_clicks, assetklasse, anlageart, region, land, währung, se
         show_error[-2] = 'Bitte wähle zunächst mindestens eine Kategorie aus'
         return show_error
 
+    # the optimization window moves daily and the result depends on the imported price history and the config
+    cache_key = make_key(categories=flattened_cats, extra_isins=extra_isins, rr_model=rr_model, opt_method=opt_method,
+                         betrag=betrag, zinssatz=zinssatz, target_return=target_return, target_risk=target_risk,
+                         cutoff=cutoff, rounding=rounding, create_hist_perf=bool(create_hist_perf),
+                         alloc_algorithm=bool(alloc_algorithm), day=datetime.date.today().isoformat(),
+                         data_version=history_version(),
+                         settings={section: config.get_section(section) for section in result_config_sections})
+    cached = result_cache.get(cache_key)
+    if cached is not None or cached_only:
+        return cached
+
+    report_progress(job_id, 10, 'Filtere ETFs')
     session = Session()
-    isins = get_isins_from_filters(flattened_cats, extra_isins, session)
-    if not isins:
+    try:
+        isins = get_isins_from_filters(flattened_cats, extra_isins, session)
+        if not isins:
+            show_error[-2] = 'Die Datenbank enthält keine ETFs für den ausgewählten Filter'
+            return show_error
+
+        # 2. Step: Optimize the portfolio and get matching names for the ISINs used
+        report_progress(job_id, 20, 'Lade Preisdaten')
+        now = datetime.datetime.now()
+        three_years_ago = now - relativedelta(years=3)
+        isins = preprocess_isin_price_data(isins, session, three_years_ago, now)
+        etf_names = pd.read_sql(session.query(Etf.isin, Etf.name).filter(Etf.isin.in_(isins)).statement, session.bind)
+        rr_model = ReturnRiskModel(rr_model)
+        opt_method = Optimizer(opt_method)
+        opt = PortfolioOptimizer(isins, three_years_ago, now, session, rr_model)
+
+        if opt.prices.empty:
+            show_error[-2] = 'Die Datenbank scheint keine Preisdaten für die ausgewählten ISINs zu enthalten :('
+            return show_error
+
+        opt.prepare_optmizer()
+
+        # 3. Step: Plot efficient frontier before calculating max sharpe
+        # (see https://github.com/robertmartin8/PyPortfolioOpt/issues/332)
+        report_progress(job_id, 40, 'Berechne Effizienzgrenze')
+        ef_figure = plot_efficient_frontier(opt.frontier, show_assets=True)
+
+        # 4. Step: Prepare resulting values and bring them into a usable data format
+        report_progress(job_id, 60, 'Berechne Allokation')
+        leftover, res, excpt = get_alloc_result(opt, opt_method, etf_names, betrag, cutoff, zinssatz, target_return, target_risk, rounding, alloc_algorithm)
+        if excpt is not None:
+            show_error[-2] = f'Während der Optimierung ist ein Fehler aufgetreten: "{str(excpt)}". ' \
+                             f'Manche Fehler können gelöst werden indem Optimierungsparameter angepasst werden!'
+            return show_error
+
+        # 5. Step: Show allocation results via different visuals
+        pp = fill_allocation_pie(res)
+        report_progress(job_id, 80, 'Berechne historische Performance')
+        hist_figure = display_hist_perf(opt_method, create_hist_perf, isins, etf_names, rr_model, betrag, cutoff,
+                                        zinssatz, target_return, target_risk, rounding, session, three_years_ago, now, alloc_algorithm)
+        dt_data = fill_datatable_allocation(res, rounding)
+
+        perf_values = map(lambda x: str(round(x, rounding)), opt.ef.portfolio_performance())
+        alloc_info = format_allocation_report(opt.allocation_report)
+        result = [{'display': 'inline'}, *perf_values, str(round(leftover, rounding)), alloc_info, dt_data, pp, ef_figure,
+                  hist_figure, '', False]
+    finally:
         session.close()
-        show_error[-2] = 'Die Datenbank enthält keine ETFs für den ausgewählten Filter'
-        return show_error
 
-    # 2. Step: Optimize the portfolio and get matching names for the ISINs used
-    now = datetime.datetime.now()
-    three_years_ago = now - relativedelta(years=3)
-    isins = preprocess_isin_price_data(isins, session, three_years_ago)
-    etf_names = pd.read_sql(session.query(Etf.isin, Etf.name).filter(Etf.isin.in_(isins)).statement, session.bind)
-    rr_model = ReturnRiskModel(rr_model)
-    opt_method = Optimizer(opt_method)
-    opt = PortfolioOptimizer(isins, three_years_ago, now, session, rr_model)
-
-    if opt.prices.empty:
-        show_error[-2] = 'Die Datenbank scheint keine Preisdaten für die ausgewählten ISINs zu enthalten :('
-        session.close()
-        return show_error
+    result_cache.put(cache_key, result)
+    return result
 
-    opt.prepare_optmizer()
 
-    # 3. Step: Plot efficient frontier before calculating max sharpe
-    # (see https://github.com/robertmartin8/PyPortfolioOpt/issues/332)
-    ef_figure = plot_efficient_frontier(opt.ef, show_assets=True)
+def error_output(message):
+    """
+    Returns the output values of an optimization showing only the error message
+    """
+    return [{'display': 'none'}, '', '', '', '', '', None, {}, {}, {}, message, True]
 
-    # 4. Step: Prepare resulting values and bring them into a usable data format
-    leftover, res, excpt = get_alloc_result(opt, opt_method, etf_names, betrag, cutoff, zinssatz, target_return, target_risk, rounding, alloc_algorithm)
-    if excpt is not None:
-        show_error[-2] = f'Während der Optimierung ist ein Fehler aufgetreten: "{str(excpt)}". ' \
-                         f'Manche Fehler können gelöst werden indem Optimierungsparameter angepasst werden!'
-        session.close()
-        return show_error
 
-    # 5. Step: Show allocation results via different visuals
-    pp = fill_allocation_pie(res)
-    hist_figure = display_hist_perf(opt_method, create_hist_perf, isins, etf_names, rr_model, betrag, cutoff,
-                                    zinssatz, target_return, target_risk, rounding, session, three_years_ago, now, alloc_algorithm)
-    dt_data = fill_datatable_allocation(res, rounding)
-    session.close()
+def background_jobs_enabled():
+    return config.get_value('background-jobs', 'enabled').lower() in ('true', 'yes', '1')
 
-    perf_values = map(lambda x: str(round(x, rounding)), opt.ef.portfolio_performance())
-    return [{'display': 'inline'}, *perf_values, str(round(leftover, rounding)), dt_data, pp, ef_figure, hist_figure, '', False]
 
+def preprocess_isin_price_data(isins, session, start_date, end_date=None):
+    """
+    Returns the ISINs with price data at the start of the date range.
+
+    If the coverage of the price history is available, ISINs whose history ends early or is sparse are rejected as well.
+    """
+    eligible = eligible_isins(session, isins, start_date, end_date)
+    if eligible is not None:
+        return eligible
 
-def preprocess_isin_price_data(isins, session, start_date):
     buffer_start = start_date - relativedelta(days=10)
 
+    panel = load_price_panel(history_version())
+    if panel is not None:
+        return panel.isins_with_data(isins, *normalize_date_range(buffer_start, start_date))
+
     data = session.query(EtfHistory.isin) \
         .filter(EtfHistory.datapoint_date.between(buffer_start, start_date)) \
         .filter(EtfHistory.isin.in_(isins)).distinct()
@@ -595,9 +733,11 @@ def get_alloc_result(opt, opt_method, etf_names, betrag, cutoff, zinssatz, targe
         if opt_method == Optimizer.MAX_SHARPE:
             opt_res = opt.ef.max_sharpe(risk_free_rate=zinssatz)
         elif opt_method == Optimizer.EFFICIENT_RISK:
-            opt_res = opt.ef.efficient_risk(target_volatility=target_risk)
+            opt_res = opt.frontier.to_weights_dict(opt.frontier.efficient_risk(target_risk))
+            opt.ef.set_weights(opt_res)
         elif opt_method == Optimizer.EFFICIENT_RETURN:
-            opt_res = opt.ef.efficient_return(target_return=target_return)
+            opt_res = opt.frontier.to_weights_dict(opt.frontier.efficient_return(target_return))
+            opt.ef.set_weights(opt_res)
     except ValueError as e:
         return None, None, e
 
@@ -663,6 +803,19 @@ def show_empty_hist_figure(start_date, end_date):
     return hist_figure
 
 
+def format_allocation_report(report):
+    """
+    Describes which allocation algorithm was used, how long it took, whether it stopped before proving the allocation
+    optimal and why it fell back to greedy allocation
+    """
+    text = f"{report.method} ({report.solve_time:.2f} s)"
+    if report.early_stop:
+        text += f", vorzeitig beendet ({report.early_stop}), Allokation nicht nachweislich optimal"
+    if report.fallback_reason:
+        text += f", Rückfall auf Greedy Allokation: {report.fallback_reason}"
+    return text
+
+
 def fill_allocation_pie(res):
     """
     Fills the pie chart with the portfolio allocation data
@@ -699,52 +852,49 @@ def prepare_hist_data(opt_method, etf_names, opt_hist, betrag, cutoff,
     relevant_isin_weights, relevant_isins = get_relevant_isins(res)
     prices = get_prices(relevant_isins, session, start_date, end_date)
 
-    # Consider the weights of the optimal strategy
-    money_distribution = {}
-    for isin in relevant_isins:
-        money_distribution[isin] = (betrag * relevant_isin_weights[isin]) / prices[prices['isin'] == isin].iloc[0][
-            'price']
+    # Consider the weights of the optimal strategy and the invested amount
+    return portfolio_value(prices, betrag * pd.Series(relevant_isin_weights))
 
-    # Consider the invested amount
-    for isin in relevant_isins:
-        prices['price'] = np.where(prices['isin'] == isin,
-                                   prices['price'] * money_distribution[isin],
-                                   prices['price'])
 
-    # Calculate the value of the investment
-    prices = prices.drop(columns='isin')
-    prices = prices.groupby('datapoint_date', as_index=False).filter(lambda x: len(x) == len(relevant_isins))
-    prices = prices.groupby('datapoint_date', as_index=False)['price'].sum()
+def portfolio_value(prices: pd.DataFrame, investments: pd.Series) -> pd.DataFrame:
+    """
+    Returns the value (Wert) of a portfolio on each date (Datum), given the prices as a dates x ISINs matrix and the
+    amount invested into each ISIN at its first price.
+
+    Dates without a price for every ISIN of the portfolio are left out.
+    """
+    prices = prices.reindex(columns=investments.index)
+    first_prices = prices.bfill().iloc[0] if len(prices) else pd.Series(np.nan, index=investments.index)
+    if first_prices.isna().any():
+        raise ValueError(f"No prices available for {', '.join(first_prices.index[first_prices.isna()])}")
 
-    # Show the result
-    prices = prices.rename(columns={"price": "Wert", "datapoint_date": "Datum"})
-    return prices
+    shares = (investments / first_prices).to_numpy()
+    complete = prices.notna().all(axis=1).to_numpy()
+    return pd.DataFrame({'Datum': prices.index[complete], 'Wert': prices.to_numpy()[complete] @ shares})
 
 
 def get_prices(isins, session, start_date, end_date):
     """
-    Returns the prices for a date range and a list of isins
+    Returns the prices for a date range and a list of isins as a dates x ISINs matrix
     """
 
+    panel = load_price_panel(history_version())
+    if panel is not None:
+        return panel.price_matrix(isins, *normalize_date_range(start_date, end_date))
+
     query = session.query(EtfHistory.datapoint_date, EtfHistory.isin, EtfHistory.price) \
         .filter(EtfHistory.datapoint_date.between(start_date, end_date)) \
         .filter(EtfHistory.isin.in_(isins)).statement
     prices = pd.read_sql(query, session.bind)
-    return prices
+    return prices.pivot(index='datapoint_date', columns='isin', values='price')
 
 
 def get_relevant_isins(res):
     """
     Returns only the ISINs with weight > 0 and their respective weights.
     """
-    relevant_isins = []
-    relevant_isin_weights = {}
-    for _, row in res.iterrows():
-        if row['weight'] > 0:
-            relevant_isins.append(row['isin'])
-            relevant_isin_weights[row['isin']] = row['weight']
-
-    return relevant_isin_weights, relevant_isins
+    relevant = res[res['weight'] > 0]
+    return dict(zip(relevant['isin'], relevant['weight'])), relevant['isin'].tolist()
 
 
 def to_dropdown_format(list, sort_function):
@@ -771,6 +921,8 @@ def run_gui(debug=False):
     Starts the GUI.
     """
     create_table(sql_engine)
+    if background_jobs_enabled():
+        job_manager.start()
     create_app(app)
     app.title = "ETF Portfolio Optimizer"
     app.run_server(debug=debug)
@@ -0,0 +1,180 @@
+import json
+import logging
+import multiprocessing
+import os
+import pickle
+import shutil
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+import config
+
+jobs_dir = Path(config.cache_dir, 'jobs')
+state_file = 'state.json'
+result_file = 'result.pickle'
+cancel_file = 'cancel'
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+class JobCancelled(Exception):
+    """
+    Raised inside a job when the user has cancelled it
+    """
+    pass
+
+
+@dataclass
+class JobStatus:
+    """
+    The state of a background job as seen by the GUI
+    """
+    state: str
+    progress: int
+    stage: str
+    error: Optional[str] = None
+    result: Optional[list] = None
+
+    @property
+    def finished(self):
+        return self.state in (DONE, FAILED, CANCELLED)
+
+
+class JobManager:
+    """
+    Runs long optimizations in a local pool of worker processes, so the Dash request threads are not blocked.
+
+    Job state, progress and results are exchanged through files, hence any server process can report the status of
+    any job. Requests exceeding the number of workers are queued. Jobs whose state has not changed for max_age seconds,
+    e.g. superseded or abandoned ones, are deleted when further jobs are submitted.
+    """
+
+    def __init__(self, max_workers: int, max_age: float):
+        self.max_workers = max_workers
+        self.max_age = max_age
+        self.executor = None
+        self.futures = {}
+
+    def start(self):
+        """
+        Starts the worker processes. Should be called before the server handles requests.
+
+        The workers are spawned instead of forked, a fork from a request thread would inherit locks held by other
+        threads at that moment, e.g. of the caches or logging, and deadlock on them.
+        """
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                mp_context=multiprocessing.get_context('spawn'))
+
+    def submit(self, fn, *args) -> str:
+        """
+        Queues fn(*args, job_id=...) for execution and returns the id of the job
+        """
+        self.start()
+        self.cleanup()
+
+        job_id = uuid.uuid4().hex
+        Path(jobs_dir, job_id).mkdir(parents=True)
+        _write_state(job_id, QUEUED, 0, 'In Warteschlange')
+        self.futures[job_id] = self.executor.submit(_run_job, job_id, fn, args)
+        return job_id
+
+    def status(self, job_id: str) -> JobStatus:
+        """
+        Returns the current status of the job including its result once it is done
+        """
+        try:
+            with open(Path(jobs_dir, job_id, state_file)) as f:
+                status = JobStatus(**json.load(f))
+        except (OSError, ValueError):
+            return JobStatus(FAILED, 0, '', error='Der Auftrag wurde nicht gefunden')
+
+        if status.state == DONE:
+            with open(Path(jobs_dir, job_id, result_file), 'rb') as f:
+                status.result = pickle.load(f)
+        return status
+
+    def cancel(self, job_id: str):
+        """
+        Requests cancellation of the job. Running jobs stop at the beginning of their next stage.
+        """
+        job_dir = Path(jobs_dir, job_id)
+        if not job_dir.exists():
+            return
+
+        Path(job_dir, cancel_file).touch()
+        future = self.futures.get(job_id)
+        if future is not None and future.cancel():
+            _write_state(job_id, CANCELLED, 0, 'Abgebrochen')
+
+    def remove(self, job_id: str):
+        """
+        Deletes all files of a finished job
+        """
+        self.futures.pop(job_id, None)
+        shutil.rmtree(Path(jobs_dir, job_id), ignore_errors=True)
+
+    def cleanup(self):
+        """
+        Deletes all jobs whose state has not changed for max_age seconds
+        """
+        if not jobs_dir.exists():
+            return
+
+        now = time.time()
+        for job_dir in jobs_dir.iterdir():
+            try:
+                age = now - Path(job_dir, state_file).stat().st_mtime
+            except OSError:
+                # the state of a job being submitted is written right after its directory has been created
+                age = now - job_dir.stat().st_mtime
+            if age > self.max_age:
+                self.remove(job_dir.name)
+
+
+def report_progress(job_id: Optional[str], progress: int, stage: str):
+    """
+    Reports the progress of a job from within the job, does nothing when not running as a job.
+
+    Raises JobCancelled if the user has cancelled the job in the meantime.
+    """
+    if job_id is None:
+        return
+
+    if Path(jobs_dir, job_id, cancel_file).exists():
+        raise JobCancelled()
+    _write_state(job_id, RUNNING, progress, stage)
+
+
+def _run_job(job_id, fn, args):
+    """
+    Executes a job inside a worker process and stores its outcome
+    """
+    try:
+        report_progress(job_id, 0, 'Gestartet')
+        result = fn(*args, job_id=job_id)
+        with open(Path(jobs_dir, job_id, result_file), 'wb') as f:
+            pickle.dump(result, f)
+        _write_state(job_id, DONE, 100, 'Fertig')
+    except JobCancelled:
+        _write_state(job_id, CANCELLED, 0, 'Abgebrochen')
+    except Exception as e:
+        logging.exception(f"Background job {job_id} failed")
+        _write_state(job_id, FAILED, 0, 'Fehlgeschlagen', str(e))
+
+
+def _write_state(job_id, state, progress, stage, error=None):
+    job_dir = Path(jobs_dir, job_id)
+    fd, tmp = tempfile.mkstemp(dir=job_dir, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump({'state': state, 'progress': progress, 'stage': stage, 'error': error}, f)
+    os.replace(tmp, Path(job_dir, state_file))
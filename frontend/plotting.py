@@ -2,27 +2,13 @@
 # Source code is taken from https://github.com/robertmartin8/PyPortfolioOpt/blob/master/pypfopt/plotting.py
 # and modified to work with plotly
 
-import copy
-
 import numpy as np
 import plotly
 import plotly.graph_objects as go
 from plotly.graph_objs import Figure
-from pypfopt import exceptions, EfficientFrontier, CLA
-
-
-def _ef_default_returns_range(ef, points):
-    """
-    Helper function to generate a range of returns from the GMV returns to
-    the maximum (constrained) returns
-    """
-    ef_minvol = copy.deepcopy(ef)
-    ef_maxret = copy.deepcopy(ef)
+from pypfopt import EfficientFrontier, CLA
 
-    ef_minvol.min_volatility()
-    min_ret = ef_minvol.portfolio_performance()[0]
-    max_ret = ef_maxret._max_return()
-    return np.linspace(min_ret, max_ret - 0.0001, points)
+from frontier import EfficientFrontierEngine
 
 
 def _plot_cla(cla, points, fig, show_assets):
@@ -71,33 +57,11 @@ def _plot_cla(cla, points, fig, show_assets):
     return fig
 
 
-def _plot_ef(ef, ef_param, ef_param_range, fig: Figure, show_assets):
+def _plot_ef(engine: EfficientFrontierEngine, ef_param, ef_param_range, fig: Figure, show_assets):
     """
-    Helper function to plot the efficient frontier from an EfficientFrontier object
+    Helper function to plot the efficient frontier from an EfficientFrontierEngine object
     """
-    mus, sigmas = [], []
-
-    # Create a portfolio for each value of ef_param_range
-    for param_value in ef_param_range:
-        ef_i = copy.deepcopy(ef)
-
-        try:
-            if ef_param == "utility":
-                ef_i.max_quadratic_utility(param_value)
-            elif ef_param == "risk":
-                ef_i.efficient_risk(param_value)
-            elif ef_param == "return":
-                ef_i.efficient_return(param_value)
-            else:
-                raise NotImplementedError(
-                    "ef_param should be one of {'utility', 'risk', 'return'}"
-                )
-        except exceptions.OptimizationError:
-            continue
-
-        ret, sigma, _ = ef_i.portfolio_performance()
-        mus.append(ret)
-        sigmas.append(sigma)
+    sigmas, mus, _ = engine.sweep(ef_param, ef_param_range)
 
     fig.add_trace(
         go.Scatter(
@@ -111,8 +75,8 @@ def _plot_ef(ef, ef_param, ef_param_range, fig: Figure, show_assets):
     if show_assets:
         fig.add_trace(
             go.Scatter(
-                x=np.sqrt(np.diag(ef.cov_matrix)),
-                y=ef.expected_returns,
+                x=np.sqrt(np.diag(engine.cov_matrix)),
+                y=engine.expected_returns,
                 name='ETFs',
                 mode="markers",
                 marker=dict(size=10, color="black")
@@ -132,7 +96,7 @@ def plot_efficient_frontier(
     """
     Plot the efficient frontier based on either a CLA or EfficientFrontier object.
     :param opt: an instantiated optimizer object BEFORE optimising an objective
-    :type opt: EfficientFrontier or CLA
+    :type opt: EfficientFrontier, EfficientFrontierEngine or CLA
     :param ef_param: [EfficientFrontier] whether to use a range over utility, risk, or return.
                      Defaults to "return".
     :type ef_param: str, one of {"utility", "risk", "return"}.
@@ -155,13 +119,15 @@ def plot_efficient_frontier(
 
     if isinstance(opt, CLA):
         fig = _plot_cla(opt, points, fig=fig, show_assets=show_assets)
-    elif isinstance(opt, EfficientFrontier):
+    elif isinstance(opt, (EfficientFrontier, EfficientFrontierEngine)):
+        if isinstance(opt, EfficientFrontier):
+            opt = EfficientFrontierEngine.from_efficient_frontier(opt)
         if ef_param_range is None:
-            ef_param_range = _ef_default_returns_range(opt, points)
+            ef_param_range = opt.default_returns_range(points)
 
         fig = _plot_ef(opt, ef_param, ef_param_range, fig=fig, show_assets=show_assets)
     else:
-        raise NotImplementedError("Please pass EfficientFrontier or CLA object")
+        raise NotImplementedError("Please pass EfficientFrontier, EfficientFrontierEngine or CLA object")
 
     fig.update_layout(
         xaxis_title='Volatilität',
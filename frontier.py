@@ -0,0 +1,139 @@
+import logging
+from collections import OrderedDict
+
+import cvxpy as cp
+import numpy as np
+import pandas as pd
+from pypfopt import EfficientFrontier
+
+
+class EfficientFrontierEngine:
+    """
+    EfficientFrontierEngine computes many points of the efficient frontier of the same expected returns and covariance.
+
+    Instead of building and solving a fresh cvxpy problem per point, each problem is built once with a cvxpy Parameter
+    for the target return, risk or risk aversion, so consecutive solves can be warm-started.
+    """
+
+    def __init__(self, expected_returns: pd.Series, cov_matrix: pd.DataFrame, weight_bounds=(0, 1)):
+        self.tickers = list(expected_returns.index)
+        self.expected_returns = np.asarray(expected_returns, dtype=float)
+        self.cov_matrix = np.asarray(cov_matrix, dtype=float)
+
+        n = len(self.tickers)
+        lower, upper = weight_bounds
+        self._w = cp.Variable(n)
+        self._ret = self.expected_returns @ self._w
+        self._variance = cp.quad_form(self._w, self.cov_matrix)
+        self._constraints = [cp.sum(self._w) == 1, self._w >= lower, self._w <= upper]
+
+        self._target_return = cp.Parameter(name='target_return')
+        self._target_variance = cp.Parameter(name='target_variance', nonneg=True)
+        self._risk_aversion = cp.Parameter(name='risk_aversion', nonneg=True)
+        self._problems = {
+            'return': cp.Problem(cp.Minimize(self._variance), [*self._constraints, self._ret >= self._target_return]),
+            'risk': cp.Problem(cp.Maximize(self._ret), [*self._constraints, self._variance <= self._target_variance]),
+            'utility': cp.Problem(cp.Maximize(self._ret - 0.5 * self._risk_aversion * self._variance),
+                                  self._constraints),
+        }
+        self._max_ret = None
+
+    @classmethod
+    def from_efficient_frontier(cls, ef: EfficientFrontier):
+        """
+        Creates an engine for the expected returns, covariance and weight bounds of an EfficientFrontier object
+        """
+        return cls(pd.Series(ef.expected_returns, index=ef.tickers), ef.cov_matrix,
+                   (ef._lower_bounds, ef._upper_bounds))
+
+    def min_volatility(self):
+        """
+        Returns the weights of the global minimum volatility portfolio
+        """
+        # a target below every expected return makes the return constraint inactive
+        return self.__solve('return', self.expected_returns.min() - 1)
+
+    def max_return(self):
+        """
+        Returns the maximum return reachable within the weight bounds
+        """
+        if self._max_ret is None:
+            cp.Problem(cp.Maximize(self._ret), self._constraints).solve()
+            self._max_ret = self._ret.value
+        return self._max_ret
+
+    def efficient_return(self, target_return):
+        """
+        Returns the weights minimising volatility for the given target return, see EfficientFrontier.efficient_return
+        """
+        if not isinstance(target_return, float) or target_return < 0:
+            raise ValueError("target_return should be a positive float")
+        if target_return > self.max_return():
+            raise ValueError("target_return must be lower than the maximum possible return")
+
+        return self.__solve('return', target_return)
+
+    def efficient_risk(self, target_volatility):
+        """
+        Returns the weights maximising return for the given target volatility, see EfficientFrontier.efficient_risk
+        """
+        if not isinstance(target_volatility, (float, int)) or target_volatility < 0:
+            raise ValueError("target_volatility should be a positive float")
+
+        global_min_volatility = np.sqrt(1 / np.sum(np.linalg.pinv(self.cov_matrix)))
+        if target_volatility < global_min_volatility:
+            raise ValueError(f"The minimum volatility is {global_min_volatility:.3f}. Please use a higher "
+                             f"target_volatility")
+
+        return self.__solve('risk', target_volatility ** 2)
+
+    def default_returns_range(self, points):
+        """
+        Returns a range of target returns from the minimum volatility portfolio's return to the maximum return
+        """
+        min_ret = self.expected_returns @ self.min_volatility()
+        return np.linspace(min_ret, self.max_return() - 0.0001, points)
+
+    def sweep(self, ef_param, ef_param_range):
+        """
+        Computes a portfolio for each value of ef_param_range and returns their volatilities, returns and weights
+
+        Points for which the problem cannot be solved are left out.
+        """
+        if ef_param not in self._problems:
+            raise NotImplementedError("ef_param should be one of {'utility', 'risk', 'return'}")
+
+        weights = []
+        for param_value in ef_param_range:
+            if ef_param == 'risk':
+                param_value = param_value ** 2
+
+            try:
+                weights.append(self.__solve(ef_param, param_value))
+            except ValueError:
+                continue
+
+        weights = np.array(weights).reshape(-1, len(self.tickers))
+        mus = weights @ self.expected_returns
+        sigmas = np.sqrt(np.einsum('ij,jk,ik->i', weights, self.cov_matrix, weights))
+        return sigmas, mus, weights
+
+    def to_weights_dict(self, weights):
+        return OrderedDict(zip(self.tickers, weights))
+
+    def __solve(self, ef_param, param_value):
+        problem = self._problems[ef_param]
+        parameter = {'return': self._target_return, 'risk': self._target_variance,
+                     'utility': self._risk_aversion}[ef_param]
+        parameter.value = param_value
+
+        try:
+            problem.solve(warm_start=True)
+        except cp.error.SolverError as e:
+            raise ValueError(f"Solver failed for {ef_param} {param_value}") from e
+
+        if problem.status not in {cp.OPTIMAL, cp.OPTIMAL_INACCURATE} or self._w.value is None:
+            logging.debug(f"No efficient portfolio found for {ef_param} {param_value}: {problem.status}")
+            raise ValueError("Please check your objectives/constraints or use a different solver.")
+
+        return self._w.value.copy()
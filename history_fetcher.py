@@ -0,0 +1,173 @@
+import logging
+import queue
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from db import Session
+from history_writer import ImportStats, has_history, record_attempt, write_prices
+from import_journal import DONE, FAILED, NO_DATA, finish_item
+from ric_cache import RicEntry, load_ric_entries, save_fetch_result, save_rics
+
+
+class HistoryFetcher:
+    """
+    Downloads the price histories of many ISINs concurrently and writes them to database on a separate thread.
+
+    RICs unknown from previous imports are resolved in batches first. The downloads run on a bounded thread pool, while
+    a single writer thread stores the results, so waiting for the API overlaps with database writes.
+
+    fetch_prices returns the prices and the request (data path) that returned them, or None for both if there are no
+    prices from the start date on. Requests raising an error are retried with exponential backoff, ISINs still failing
+    afterwards are journaled as failed, so a resumed import retries them. ISINs without any stored prices for which no
+    request returns prices are skipped by later imports until the TTL has passed. ISINs with stored prices are never
+    skipped, their range since the last import is often empty, e.g. on weekends.
+    """
+
+    def __init__(self, resolve_rics: Callable[[List[str]], Dict[str, Optional[str]]],
+                 fetch_prices: Callable[[str, Optional[str], Optional[str], date],
+                                        Tuple[Optional[pd.DataFrame], Optional[str]]],
+                 workers: int, ric_batch_size: int, ttl: timedelta, retries: int = 0, backoff: float = 1.0):
+        self.resolve_rics = resolve_rics
+        self.fetch_prices = fetch_prices
+        self.workers = workers
+        self.ric_batch_size = ric_batch_size
+        self.ttl = ttl
+        self.retries = retries
+        self.backoff = backoff
+
+    def run(self, start_dates: Dict[str, date], stats: ImportStats, run_id: int = None):
+        """
+        Fetches the prices of each ISIN from its start date until today and writes them to database
+
+        If a run id is given, the outcome of each ISIN is journaled within the import run.
+        """
+        now = datetime.now()
+        session = Session()
+        entries = load_ric_entries(session)
+
+        isins = [isin for isin in start_dates if isin not in entries or not entries[isin].is_dead(now, self.ttl)]
+        if len(isins) < len(start_dates):
+            print(f'Skipping {len(start_dates) - len(isins)} ISINs without price data in recent imports')
+            if run_id is not None:
+                for isin in set(start_dates) - set(isins):
+                    finish_item(session, run_id, isin, NO_DATA)
+
+        to_resolve = [isin for isin in isins if isin not in entries or entries[isin].needs_lookup(now, self.ttl)]
+        for i in range(0, len(to_resolve), self.ric_batch_size):
+            rics = self.resolve_rics(to_resolve[i:i + self.ric_batch_size])
+            save_rics(session, rics)
+            for isin, ric in rics.items():
+                entry = entries.get(isin, RicEntry(None, None, None, None))
+                entries[isin] = RicEntry(ric, now, entry.data_path, entry.no_data_since)
+        session.close()
+
+        results = queue.Queue(maxsize=2 * self.workers)
+        writer_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='history-writer')
+        writer = writer_executor.submit(self.__write, results, stats, run_id)
+
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='history-fetcher')
+        try:
+            futures = {}
+            for isin in isins:
+                entry = entries.get(isin, RicEntry(None, None, None, None))
+                futures[executor.submit(self.__fetch, isin, entry.ric, entry.data_path, start_dates[isin])] = isin
+
+            start = time.monotonic()
+            for done, future in enumerate(as_completed(futures), 1):
+                self.__put(results, (futures[future], *future.result()), writer)
+                if done % 10 == 0 or done == len(futures):
+                    eta = (time.monotonic() - start) / done * (len(futures) - done)
+                    print(f'Fetched {done}/{len(futures)} ISINs, ETA {timedelta(seconds=round(eta))}')
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            writer_executor.shutdown(wait=False)
+            if not writer.done():
+                self.__put(results, None, writer)
+            # raises the error that stopped the writer
+            writer.result()
+
+    def __fetch(self, isin, ric, data_path, start_date):
+        """
+        Returns the prices, the data path and whether all attempts failed
+        """
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+
+            try:
+                prices, data_path = self.fetch_prices(isin, ric, data_path, start_date)
+            except Exception as e:
+                logging.warning(f'Fetching prices for {isin} failed: {e}')
+                continue
+            return prices, data_path, False
+
+        return None, None, True
+
+    @staticmethod
+    def __put(results: queue.Queue, item, writer: Future):
+        """
+        Puts the item into the bounded queue, raising the error of the writer if it has stopped and cannot take it
+        """
+        while True:
+            if writer.done():
+                writer.result()
+                raise RuntimeError('The history writer has stopped')
+            try:
+                results.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    @staticmethod
+    def __write(results: queue.Queue, stats: ImportStats, run_id):
+        """
+        Stores the fetched prices until None is received.
+
+        ISINs whose prices cannot be saved are journaled as failed. The writer only stops with an error if even that
+        fails, e.g. because the database is unreachable.
+        """
+        session = Session()
+        try:
+            while True:
+                item = results.get()
+                if item is None:
+                    break
+
+                isin = item[0]
+                try:
+                    status, rows_written = HistoryFetcher.__save(session, *item, stats)
+                    if run_id is not None:
+                        finish_item(session, run_id, isin, status, rows_written)
+                except Exception:
+                    session.rollback()
+                    logging.exception(f'Could not save price data for {isin}')
+                    if run_id is not None:
+                        finish_item(session, run_id, isin, FAILED)
+        finally:
+            session.close()
+
+    @staticmethod
+    def __save(session, isin, prices, data_path, failed, stats):
+        """
+        Stores the prices of the ISIN and what has been learned about retrieving them, returns the journal status and
+        the number of written rows
+        """
+        if failed:
+            logging.error(f'Could not retrieve price data for {isin}')
+            return FAILED, 0
+
+        if prices is None or prices.empty:
+            record_attempt(session, isin)
+            if has_history(session, isin):
+                # no new prices since the last import, the data path that returned them is still right
+                return DONE, 0
+            save_fetch_result(session, isin, None)
+            return NO_DATA, 0
+
+        rows_written = write_prices(session, prices, stats)
+        save_fetch_result(session, isin, data_path)
+        return DONE, rows_written
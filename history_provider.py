@@ -0,0 +1,176 @@
+import logging
+import time
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from rate_limit import TokenBucket
+from ric_cache import GET_DATA, TIMESERIES
+
+
+class NoDataError(Exception):
+    """
+    Raised by a provider if it has answered that there are no prices for the requested ISIN or RIC in the date range
+    """
+    pass
+
+
+class HistoryProvider:
+    """
+    A source of historic prices for the history import.
+
+    Subclasses implement the RIC lookup and the two requests for price data offered by Refinitiv. Each request returns
+    the prices as columns isin, datapoint_date and price, or raises NoDataError if there are none in the requested range.
+    Other errors, e.g. of the network or the API quota, are raised as they are.
+    """
+
+    def resolve_rics(self, isins: List[str]) -> Dict[str, Optional[str]]:
+        """
+        Looks up the RICs of all given ISINs, None for ISINs without RIC
+        """
+        raise NotImplementedError()
+
+    def get_timeseries(self, isin: str, ric: str, start_date: date) -> pd.DataFrame:
+        raise NotImplementedError()
+
+    def get_data(self, isin: str, start_date: date) -> pd.DataFrame:
+        raise NotImplementedError()
+
+    def fetch_prices(self, isin: str, ric: Optional[str], data_path: Optional[str],
+                     start_date: date) -> Tuple[Optional[pd.DataFrame], Optional[str]]:
+        """
+        Extracts historic price data consisting of timestamps and prices of the ISIN from the start date to today
+
+        For some ISINs no data is available with the get_timeseries function (weird API behaviour), the prices of these
+        are requested with the get_data function. If a previous import has shown that only get_data works, get_timeseries
+        is not tried. Returns the prices and the data path that returned them, None for both if neither request has data
+        from the start date on. That does not mean the ISIN has no prices at all, e.g. on weekends the range since the
+        last import is empty. Errors other than missing data are raised, so they are not mistaken for missing prices.
+        """
+        if ric is not None and data_path != GET_DATA:
+            try:
+                return self.get_timeseries(isin, ric, start_date), TIMESERIES
+            except NoDataError:
+                logging.warning(f'No get_timeseries data available for {isin}')
+
+        try:
+            return self.get_data(isin, start_date), GET_DATA
+        except NoDataError:
+            # For some ISINs no data is available with the get_data function
+            logging.warning(f'No get_data values available for {isin}')
+            return None, None
+
+
+class RefinitivProvider(HistoryProvider):
+    """
+    Retrieves prices from the Refinitiv API, limited to the configured number of requests per second.
+
+    The api is the eikon module or a replacement with the same functions, e.g. a local fake for testing. The API raises
+    the same error type for missing data as for failed requests, hence errors are told apart by their message.
+    """
+
+    # parts of the error messages with which the API answers requests for prices that do not exist (lower case)
+    no_data_messages = ('no data', 'unable to collect data', 'invalid ric', 'invalid instrument')
+
+    def __init__(self, api, requests_per_second: float):
+        self.api = api
+        self.bucket = TokenBucket(requests_per_second)
+
+    def resolve_rics(self, isins: List[str]) -> Dict[str, Optional[str]]:
+        """
+        Looks up the RICs of all given ISINs with a single request
+        """
+        self.bucket.acquire()
+        try:
+            data = self.api.get_data(isins, ['TR.LipperRICCode'])[0]
+        except Exception as e:
+            logging.warning(f'Could not resolve RICs: {e}')
+            return {}
+
+        return {isin: ric if isinstance(ric, str) and ric else None for isin, ric in data.iloc[:, :2].values}
+
+    def get_timeseries(self, isin, ric, start_date):
+        self.bucket.acquire()
+        try:
+            data = self.api.get_timeseries(ric, fields=['TIMESTAMP', 'VALUE'],
+                                           start_date=start_date.strftime('%Y-%m-%d'),
+                                           end_date=date.today().strftime('%Y-%m-%d'), interval='daily')
+        except Exception as e:
+            self.__raise_no_data(e)
+            raise
+        if data is None or data.empty:
+            raise NoDataError(f'No timeseries for {ric}')
+        return pd.DataFrame({'isin': isin, 'datapoint_date': data.index.date, 'price': data.iloc[:, 0].values})
+
+    def get_data(self, isin, start_date):
+        self.bucket.acquire()
+        try:
+            data = self.api.get_data(isin, ['TR.CLOSEPRICE.date', 'TR.CLOSEPRICE'],
+                                     parameters={'SDate': start_date.strftime('%Y%m%d'),
+                                                 'EDate': date.today().strftime('%Y%m%d'), 'Frq': 'D'})
+        except Exception as e:
+            self.__raise_no_data(e)
+            raise
+        values = data[0]
+        if values is None:
+            raise NoDataError(f'No close prices for {isin}')
+        prices = pd.DataFrame({'isin': isin, 'datapoint_date': pd.to_datetime(values.iloc[:, 1].str[0:10]).dt.date,
+                               'price': pd.to_numeric(values.iloc[:, 2], errors='coerce')}).dropna()
+        # the API answers with rows without date or price rather than an error if there are no prices
+        if prices.empty:
+            raise NoDataError(f'No close prices for {isin}')
+        return prices
+
+    def __raise_no_data(self, error: Exception):
+        if any(message in str(error).lower() for message in self.no_data_messages):
+            raise NoDataError(str(error)) from error
+
+
+class ReplayProvider(HistoryProvider):
+    """
+    Serves recorded or synthetic prices from csv files named <isin>.csv with the columns datapoint_date and price.
+
+    Every request is delayed by latency seconds to simulate the round trip to the API.
+    """
+
+    def __init__(self, directory: Path, latency: float = 0.0):
+        self.directory = Path(directory)
+        self.latency = latency
+
+    def isins(self) -> List[str]:
+        return sorted(path.stem for path in self.directory.glob('*.csv'))
+
+    def resolve_rics(self, isins):
+        time.sleep(self.latency)
+        return {isin: f'{isin}.REPLAY' if Path(self.directory, f'{isin}.csv').exists() else None for isin in isins}
+
+    def get_timeseries(self, isin, ric, start_date):
+        return self.get_data(isin, start_date)
+
+    def get_data(self, isin, start_date):
+        time.sleep(self.latency)
+        if not Path(self.directory, f'{isin}.csv').exists():
+            raise NoDataError(f'No recorded prices for {isin}')
+        prices = pd.read_csv(Path(self.directory, f'{isin}.csv'), parse_dates=['datapoint_date'])
+        prices = prices[prices['datapoint_date'] >= pd.Timestamp(start_date)]
+        if prices.empty:
+            raise NoDataError(f'No recorded prices for {isin} since {start_date}')
+        return pd.DataFrame({'isin': isin, 'datapoint_date': prices['datapoint_date'].dt.date,
+                             'price': prices['price'].values})
+
+
+def write_synthetic_history(directory: Path, isins: List[str], days: int, seed: int = 0):
+    """
+    Writes random walk prices for the last days business days of each ISIN in the format read by ReplayProvider
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(end=date.today() - timedelta(days=1), periods=days)
+
+    for isin in isins:
+        prices = 100 * np.exp(np.cumsum(rng.normal(0.0002, 0.01, days)))
+        pd.DataFrame({'datapoint_date': dates.date, 'price': prices}).to_csv(Path(directory, f'{isin}.csv'),
+                                                                               index=False)
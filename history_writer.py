@@ -0,0 +1,127 @@
+import time
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import Dict, Set
+
+import pandas as pd
+from sqlalchemy import exists, func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+import config
+from db.models import EtfHistory, EtfSyncState
+
+
+@dataclass
+class ImportStats:
+    """
+    Counts the rows written by a history import and the time spent writing and committing them, and collects the ISINs
+    whose prices were written
+    """
+    rows_written: int = 0
+    write_time: float = 0.0
+    commit_time: float = 0.0
+    isins: Set[str] = field(default_factory=set)
+    start: float = field(default_factory=time.perf_counter)
+
+    def report(self) -> str:
+        elapsed = time.perf_counter() - self.start
+        rows_per_sec = self.rows_written / self.write_time if self.write_time > 0 else 0
+        return f"Wrote {self.rows_written} prices in {elapsed:.1f}s ({self.write_time:.1f}s writing of which " \
+               f"{self.commit_time:.1f}s committing, {rows_per_sec:.0f} rows/s)"
+
+
+def write_prices(session: Session, prices: pd.DataFrame, stats: ImportStats = None, overwrite=False) -> int:
+    """
+    Inserts the prices given as columns isin, datapoint_date and price into etf_history within one transaction.
+
+    Rows are sent in multi-row INSERT ... ON CONFLICT statements of the configured batch size. Prices already stored are
+    kept unless overwrite is set. The sync state of the ISINs is updated in the same transaction. Returns the number of
+    inserted or updated rows.
+    """
+    start = time.perf_counter()
+    batch_size = int(config.get_value('history-import', 'batch_size'))
+    records = prices[['isin', 'datapoint_date', 'price']].to_dict('records')
+
+    written = 0
+    try:
+        for i in range(0, len(records), batch_size):
+            statement = insert(EtfHistory).values(records[i:i + batch_size])
+            if overwrite:
+                statement = statement.on_conflict_do_update(index_elements=['isin', 'datapoint_date'],
+                                                            set_={'price': statement.excluded.price})
+            else:
+                statement = statement.on_conflict_do_nothing(index_elements=['isin', 'datapoint_date'])
+            written += session.execute(statement).rowcount
+        __update_sync_state(session, prices.groupby('isin')['datapoint_date'].max().to_dict())
+        commit_start = time.perf_counter()
+        session.commit()
+    except:
+        session.rollback()
+        raise
+
+    if stats is not None:
+        stats.rows_written += written
+        stats.write_time += time.perf_counter() - start
+        stats.commit_time += time.perf_counter() - commit_start
+        stats.isins.update(prices['isin'].unique())
+    return written
+
+
+def record_attempt(session: Session, isin: str):
+    """
+    Stores that the prices of the ISIN were requested, even if none could be retrieved
+    """
+    __update_sync_state(session, {isin: None})
+    session.commit()
+
+
+def has_history(session: Session, isin: str) -> bool:
+    """
+    Returns whether prices of the ISIN have been stored according to its sync state
+    """
+    return session.query(EtfSyncState.last_date).filter(EtfSyncState.isin == isin,
+                                                        EtfSyncState.last_date.isnot(None)).first() is not None
+
+
+def load_last_dates(session: Session) -> Dict[str, date]:
+    """
+    Returns the date of the latest stored price of each ISIN.
+
+    The sync state is initialized from the price history if it is empty, e.g. when its table has just been created in a
+    database of an older version. ISINs missing from a non-empty sync state are initialized by seed_sync_state.
+    """
+    if session.query(EtfSyncState).first() is None:
+        seed_sync_state(session)
+
+    return dict(session.query(EtfSyncState.isin, EtfSyncState.last_date).filter(EtfSyncState.last_date.isnot(None)))
+
+
+def seed_sync_state(session: Session) -> int:
+    """
+    Initializes the sync state of all ISINs with prices but without sync state from the price history, e.g. after
+    restoring a database dump of an older version. Returns the number of initialized ISINs.
+
+    Aggregates the whole etf_history table, hence it is only run on migrations and not by every import.
+    """
+    last_dates = session.query(EtfHistory.isin, func.max(EtfHistory.datapoint_date)) \
+        .filter(~exists().where(EtfSyncState.isin == EtfHistory.isin)).group_by(EtfHistory.isin)
+    # a concurrent import may have initialized the ISIN meanwhile, its sync state is more recent
+    seeded = session.execute(insert(EtfSyncState).from_select(['isin', 'last_date'], last_dates)
+                             .on_conflict_do_nothing(index_elements=['isin'])).rowcount
+    session.commit()
+    return seeded
+
+
+def __update_sync_state(session, last_dates: Dict[str, date], attempted=True):
+    if not last_dates:
+        return
+
+    now = datetime.now() if attempted else None
+    statement = insert(EtfSyncState).values([{'isin': isin, 'last_date': last_date, 'last_attempt': now}
+                                             for isin, last_date in last_dates.items()])
+    # greatest ignores NULL, hence failed attempts and re-imports of older prices keep the last date
+    statement = statement.on_conflict_do_update(index_elements=['isin'], set_={
+        'last_date': func.greatest(EtfSyncState.last_date, statement.excluded.last_date),
+        'last_attempt': func.coalesce(statement.excluded.last_attempt, EtfSyncState.last_attempt)})
+    session.execute(statement)
@@ -0,0 +1,112 @@
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+import httpx
+
+import config
+
+# responses are fetched and stored, responses already stored are served from disk
+RECORD = 'record'
+# responses are only served from disk, requests without stored response fail
+REPLAY = 'replay'
+MODES = (RECORD, REPLAY)
+
+responses_dir = Path(config.cache_dir, 'http')
+
+
+@dataclass
+class CachedResponse:
+    url: str
+    status: int
+    headers: List[Tuple[str, str]]
+    body: bytes
+
+
+class ResponseStore:
+    """
+    HTTP responses stored on local disk, keyed by the method, URL and body of their request.
+
+    The store is shared by the crawlers, so a recorded crawl can be parsed again offline.
+    """
+
+    def __init__(self, directory: Path = responses_dir):
+        self.directory = directory
+
+    def load(self, method: str, url: str, body: bytes = b'') -> Optional[CachedResponse]:
+        """
+        Returns the stored response to the request or None if there is none
+        """
+        try:
+            with open(self.__path(method, url, body), 'rb') as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def responses(self) -> Iterator[CachedResponse]:
+        """
+        Iterates over all stored responses
+        """
+        for path in sorted(self.directory.glob('*.pickle')):
+            try:
+                with open(path, 'rb') as f:
+                    yield pickle.load(f)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                continue
+
+    def save(self, method: str, url: str, body: bytes, response: CachedResponse):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(response, f)
+            os.replace(tmp, self.__path(method, url, body))
+        except (OSError, pickle.PicklingError):
+            logging.warning(f"Could not store response of {url} in cache")
+            Path(tmp).unlink(missing_ok=True)
+
+    def __path(self, method, url, body):
+        key = hashlib.sha256(f'{method.upper()} {url}\n'.encode() + (body or b'')).hexdigest()
+        return Path(self.directory, key + '.pickle')
+
+
+class CachingTransport(httpx.AsyncBaseTransport):
+    """
+    An httpx transport recording responses in a ResponseStore or replaying them from it.
+
+    In replay mode no request is sent, requests without stored response are answered with status 404.
+    """
+
+    # the stored body is already decoded
+    dropped_headers = ('content-encoding', 'content-length', 'transfer-encoding')
+
+    def __init__(self, store: ResponseStore, mode: str, transport: httpx.AsyncBaseTransport = None):
+        self.store = store
+        self.mode = mode
+        self.transport = transport if transport is not None else httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        body = await request.aread()
+        cached = self.store.load(request.method, str(request.url), body)
+        if cached is not None:
+            return httpx.Response(cached.status, headers=cached.headers, content=cached.body, request=request)
+        if self.mode == REPLAY:
+            logging.warning(f"No recorded response for {request.url}")
+            return httpx.Response(404, request=request)
+
+        response = await self.transport.handle_async_request(request)
+        content = await response.aread()
+        headers = [(k, v) for k, v in response.headers.items() if k.lower() not in self.dropped_headers]
+        # busy or failing servers are asked again on the next crawl
+        if response.status_code != 429 and response.status_code < 500:
+            self.store.save(request.method, str(request.url), body,
+                            CachedResponse(str(request.url), response.status_code, headers, content))
+        return httpx.Response(response.status_code, headers=headers, content=content, request=request)
+
+    async def aclose(self):
+        await self.transport.aclose()
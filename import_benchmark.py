@@ -0,0 +1,54 @@
+import shutil
+import tempfile
+from datetime import date
+from itertools import cycle
+from pathlib import Path
+
+from db import Session, sql_engine
+from db.models import EtfHistory, EtfRic, EtfSyncState
+from db.table_manager import create_table
+from etf_history_api import create_fetcher
+from history_provider import ReplayProvider, write_synthetic_history
+from history_writer import ImportStats
+
+# benchmark ISINs cannot collide with real ones, as no country code starts with XX
+bench_prefix = 'XXBENCH'
+
+
+def run_import_benchmark(isin_count: int, days: int, latency: float, directory: str = None) -> ImportStats:
+    """
+    Imports the prices of isin_count ISINs from a replay provider into the database and removes them afterwards.
+
+    The prices are synthetic random walks over the given number of days, or the recorded series found in directory
+    which are reused if there are fewer files than ISINs.
+    """
+    create_table(sql_engine)
+    isins = [f'{bench_prefix}{i:05d}' for i in range(isin_count)]
+
+    with tempfile.TemporaryDirectory() as replay_dir:
+        if directory is None:
+            write_synthetic_history(Path(replay_dir), isins, days)
+        else:
+            recorded = sorted(Path(directory).glob('*.csv'))
+            if not recorded:
+                raise FileNotFoundError(f'No recorded price series found in {directory}')
+            for isin, path in zip(isins, cycle(recorded)):
+                shutil.copyfile(path, Path(replay_dir, f'{isin}.csv'))
+
+        session = Session()
+        __remove_benchmark_data(session, isins)
+        stats = ImportStats()
+        try:
+            create_fetcher(ReplayProvider(Path(replay_dir), latency)).run({isin: date(1990, 1, 1) for isin in isins},
+                                                                          stats)
+        finally:
+            __remove_benchmark_data(session, isins)
+            session.close()
+
+    return stats
+
+
+def __remove_benchmark_data(session, isins):
+    for model in (EtfHistory, EtfSyncState, EtfRic):
+        session.query(model).filter(model.isin.in_(isins)).delete(synchronize_session=False)
+    session.commit()
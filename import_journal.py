@@ -0,0 +1,59 @@
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from db.models import ImportRun, ImportRunItem
+
+PENDING = 'pending'
+DONE = 'done'
+NO_DATA = 'no_data'
+FAILED = 'failed'
+
+
+def start_run(session: Session, isins: List[str]) -> int:
+    """
+    Journals a new import run of the given ISINs and returns its id
+    """
+    run = ImportRun(started_at=datetime.now())
+    session.add(run)
+    session.flush()
+    session.bulk_insert_mappings(ImportRunItem, [{'run_id': run.id, 'isin': isin, 'status': PENDING, 'rows_written': 0}
+                                                 for isin in isins])
+    session.commit()
+    return run.id
+
+
+def load_unfinished_run(session: Session) -> Optional[Tuple[int, List[str]]]:
+    """
+    Returns the id of the latest import run which has not finished and its ISINs not imported yet, None if there is none
+    """
+    run = session.query(ImportRun).order_by(ImportRun.id.desc()).first()
+    if run is None or run.finished_at is not None:
+        return None
+
+    isins = session.query(ImportRunItem.isin) \
+        .filter(ImportRunItem.run_id == run.id, ImportRunItem.status.in_([PENDING, FAILED]))
+    return run.id, [isin for (isin,) in isins]
+
+
+def finish_item(session: Session, run_id: int, isin: str, status: str, rows_written: int = 0):
+    """
+    Stores the outcome of importing the ISIN within the run
+    """
+    session.query(ImportRunItem).filter_by(run_id=run_id, isin=isin) \
+        .update({'status': status, 'rows_written': rows_written})
+    session.commit()
+
+
+def finish_run(session: Session, run_id: int) -> bool:
+    """
+    Marks the run as finished, so it cannot be resumed, unless some ISINs failed. Returns whether the run has finished.
+    """
+    failed = session.query(ImportRunItem).filter_by(run_id=run_id, status=FAILED).count()
+    if failed:
+        return False
+
+    session.query(ImportRun).filter_by(id=run_id).update({'finished_at': datetime.now()})
+    session.commit()
+    return True
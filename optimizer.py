@@ -1,4 +1,5 @@
 import logging
+import time
 from dataclasses import dataclass
 from datetime import date
 from enum import unique, IntEnum
@@ -8,11 +9,15 @@ import numpy as np
 import pandas as pd
 from pypfopt.discrete_allocation import DiscreteAllocation, get_latest_prices
 from pypfopt.efficient_frontier import EfficientFrontier
+from pypfopt.exceptions import OptimizationError
 from pypfopt.expected_returns import mean_historical_return, capm_return, ema_historical_return
 from pypfopt.risk_models import CovarianceShrinkage, semicovariance
 from sqlalchemy.orm import Session
 
-from db.models import EtfHistory
+import config
+from allocation import AllocationReport, lp_allocation
+from frontier import EfficientFrontierEngine
+from price_cache import get_price_matrix
 
 
 @unique
@@ -35,6 +40,20 @@ class Optimizer(IntEnum):
     EFFICIENT_RISK = 2
 
 
+@dataclass
+class OptimizationConfig:
+    """
+    A combination of models and parameters evaluated by PortfolioOptimizer.optimize_batch
+    """
+    return_risk_model: ReturnRiskModel
+    optimizer: Optimizer
+    risk_free_rate: float = 0.02
+    target_return: float = 0.05
+    target_risk: float = 0.1
+    cutoff: float = 0.00001
+    rounding: int = 5
+
+
 @dataclass
 class PortfolioOptimizer:
     """
@@ -48,12 +67,7 @@ class PortfolioOptimizer:
     return_risk_model: ReturnRiskModel = ReturnRiskModel.MEAN_VARIANCE
 
     def __post_init__(self):
-        query = self.session.query(EtfHistory.isin, EtfHistory.datapoint_date, EtfHistory.price) \
-            .filter(EtfHistory.datapoint_date.between(self.start_date, self.end_date)) \
-            .filter(EtfHistory.isin.in_(self.isins)).statement
-        self.prices = pd.read_sql(query, self.session.bind)
-        self.prices = self.prices.pivot(index='datapoint_date', columns='isin', values='price')
-        self.prices = self.prices.dropna()
+        self.prices = get_price_matrix(self.session, self.isins, self.start_date, self.end_date)
 
         if self.prices.empty:
             logging.warning(f"Detected empty dataframe for given ISINs. Optimizing will not produce any results.")
@@ -62,35 +76,103 @@ class PortfolioOptimizer:
         """
         Prepares the optimizer according to the chosen ReturnRiskModel on the retrieved data
         """
-        if self.return_risk_model is ReturnRiskModel.MEAN_VARIANCE:
+        mu, S = self.expected_returns_and_risk(self.return_risk_model)
+        self.ef = EfficientFrontier(mu, S)
+        self.frontier = EfficientFrontierEngine.from_efficient_frontier(self.ef)
+
+    def expected_returns_and_risk(self, return_risk_model: ReturnRiskModel):
+        """
+        Computes the expected returns and the covariance matrix according to the given ReturnRiskModel
+        """
+        if return_risk_model is ReturnRiskModel.MEAN_VARIANCE:
             mu = mean_historical_return(self.prices)
             mu = np.clip(mu, 0, 1)
             S = CovarianceShrinkage(self.prices).ledoit_wolf()
-        elif self.return_risk_model is ReturnRiskModel.CAPM_SEMICOVARIANCE:
+        elif return_risk_model is ReturnRiskModel.CAPM_SEMICOVARIANCE:
             mu = capm_return(self.prices)
             mu = np.clip(mu, 0, 1)
             S = semicovariance(self.prices)
-        elif self.return_risk_model is ReturnRiskModel.EMA_VARIANCE:
+        elif return_risk_model is ReturnRiskModel.EMA_VARIANCE:
             mu = ema_historical_return(self.prices)
             mu = np.clip(mu, 0, 1)
             S = CovarianceShrinkage(self.prices).ledoit_wolf()
         else:
             raise ValueError("return_risk_model must not be None")
 
-        self.ef = EfficientFrontier(mu, S)
+        return mu, S
+
+    def optimize_batch(self, configs: List[OptimizationConfig]) -> pd.DataFrame:
+        """
+        Evaluates all configurations on the retrieved prices and returns the results as a tidy table.
+
+        Expected returns and risk are computed once per ReturnRiskModel. The table has one row per configuration and
+        ISIN with a non-zero weight. Configurations that could not be optimized get a single row with the error.
+        """
+        models = {}
+        rows = []
+
+        for cfg in configs:
+            if cfg.return_risk_model not in models:
+                mu, S = self.expected_returns_and_risk(cfg.return_risk_model)
+                ef = EfficientFrontier(mu, S)
+                models[cfg.return_risk_model] = (mu, S, EfficientFrontierEngine.from_efficient_frontier(ef))
+            mu, S, frontier = models[cfg.return_risk_model]
+
+            cfg_values = {'return_risk_model': cfg.return_risk_model.name, 'optimizer': cfg.optimizer.name,
+                          'risk_free_rate': cfg.risk_free_rate, 'target_return': cfg.target_return,
+                          'target_risk': cfg.target_risk, 'cutoff': cfg.cutoff}
+            ef = EfficientFrontier(mu, S)
+            try:
+                if cfg.optimizer is Optimizer.MAX_SHARPE:
+                    ef.max_sharpe(risk_free_rate=cfg.risk_free_rate)
+                elif cfg.optimizer is Optimizer.EFFICIENT_RISK:
+                    ef.set_weights(frontier.to_weights_dict(frontier.efficient_risk(cfg.target_risk)))
+                elif cfg.optimizer is Optimizer.EFFICIENT_RETURN:
+                    ef.set_weights(frontier.to_weights_dict(frontier.efficient_return(cfg.target_return)))
+                else:
+                    raise ValueError("Optimization method cannot be None")
+            except (ValueError, OptimizationError) as e:
+                rows.append({**cfg_values, 'error': str(e)})
+                continue
+
+            expected_return, volatility, sharpe_ratio = ef.portfolio_performance(risk_free_rate=cfg.risk_free_rate)
+            for isin, weight in ef.clean_weights(cutoff=cfg.cutoff, rounding=cfg.rounding).items():
+                if weight > 0:
+                    rows.append({**cfg_values, 'expected_return': expected_return, 'volatility': volatility,
+                                 'sharpe_ratio': sharpe_ratio, 'isin': isin, 'weight': weight, 'error': None})
+
+        columns = ['return_risk_model', 'optimizer', 'risk_free_rate', 'target_return', 'target_risk', 'cutoff',
+                   'expected_return', 'volatility', 'sharpe_ratio', 'isin', 'weight', 'error']
+        return pd.DataFrame.from_records(rows, columns=columns)
 
     def allocate_portfolio_optimize(self, total_portfolio_value, max_sharpe):
         """
         Allocates the portfolio optimally utilizing integer programming
+
+        The configured solvers are tried in order within the time budget, otherwise the portfolio is allocated greedily.
+        How the allocation was computed is stored in allocation_report.
         """
         latest_prices = get_latest_prices(self.prices)
-        da = DiscreteAllocation(max_sharpe, latest_prices, total_portfolio_value=total_portfolio_value)
-        return da.lp_portfolio(solver="GUROBI", reinvest=True)
+        solvers = [s.strip().upper() for s in config.get_value('allocation', 'solvers').split(',') if s.strip()]
+        time_budget = float(config.get_value('allocation', 'time_budget'))
+        node_limit = int(config.get_value('allocation', 'node_limit'))
+
+        alloc, leftover, self.allocation_report = lp_allocation(max_sharpe, latest_prices, total_portfolio_value,
+                                                                solvers, time_budget, node_limit)
+        if self.allocation_report.fallback_reason:
+            logging.warning(f"Fell back to greedy allocation: {self.allocation_report.fallback_reason}")
+        if self.allocation_report.early_stop:
+            logging.info(f"Allocation with solver {self.allocation_report.method} stopped early, "
+                         f"it may not be optimal: {self.allocation_report.early_stop}")
+        return alloc, leftover
 
     def allocated_portfolio_greedy(self, total_portfolio_value, max_sharpe):
         """
         Allocates the portfolio according to the optimization result
         """
+        start = time.perf_counter()
         latest_prices = get_latest_prices(self.prices)
         da = DiscreteAllocation(max_sharpe, latest_prices, total_portfolio_value=total_portfolio_value)
-        return da.greedy_portfolio(reinvest=True)
+        alloc, leftover = da.greedy_portfolio(reinvest=True)
+        self.allocation_report = AllocationReport('greedy', time.perf_counter() - start)
+        return alloc, leftover
@@ -0,0 +1,113 @@
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List
+
+from scrapy.http import HtmlResponse
+
+from http_cache import ResponseStore
+from scraping.extractors import extract_justetf_detail
+
+
+@dataclass
+class ParseStats:
+    """
+    Compares the throughput of extracting justetf.com profile pages with selector queries and precompiled XPaths
+    """
+    pages: int
+    selector_time: float
+    extractor_time: float
+    mismatches: int
+
+    def report(self) -> str:
+        before = self.pages / self.selector_time if self.selector_time > 0 else 0
+        after = self.pages / self.extractor_time if self.extractor_time > 0 else 0
+        speedup = after / before if before > 0 else 0
+        return f"Parsed {self.pages} pages: selector queries {before:.1f} pages/s, precompiled XPaths {after:.1f} " \
+               f"pages/s ({speedup:.1f}x), {self.mismatches} pages with differing values"
+
+
+def run_parse_benchmark(directory: str = None, repeat: int = 3) -> ParseStats:
+    """
+    Extracts the values of saved justetf.com profile pages repeat times with both extraction methods.
+
+    The pages are the html files in directory or else the profile pages recorded by crawl-justetf --http-cache record.
+    Every page is parsed anew for each extraction, like a freshly downloaded response.
+    """
+    pages = __load_pages(directory)
+    if not pages:
+        raise FileNotFoundError(f'No saved justetf.com profile pages found in {directory or "the HTTP cache"}')
+
+    mismatches = sum(__extract_with_selectors(__response(url, body)) != extract_justetf_detail(
+        __response(url, body).selector.root) for url, body in pages)
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for url, body in pages:
+            __extract_with_selectors(__response(url, body))
+    selector_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for url, body in pages:
+            extract_justetf_detail(__response(url, body).selector.root)
+    extractor_time = time.perf_counter() - start
+
+    return ParseStats(len(pages) * repeat, selector_time, extractor_time, mismatches)
+
+
+def __load_pages(directory):
+    if directory is not None:
+        return [(path.resolve().as_uri(), path.read_bytes()) for path in sorted(Path(directory).glob('*.html'))]
+    return [(response.url, response.body) for response in ResponseStore().responses()
+            if 'etf-profile.html' in response.url and response.status == 200]
+
+
+def __response(url, body):
+    return HtmlResponse(url, body=body)
+
+
+def __extract_with_selectors(response) -> dict:
+    """
+    The extraction of JustetfSpider.parse_item before precompiled XPaths, one selector query per value
+    """
+    def get_table_values(selector, table_size, path) -> List[str]:
+        return [selector.xpath('*[' + str(i) + ']' + path).get() for i in range(1, table_size + 1)]
+
+    isin_parent = response.xpath('//span[@class="vallabel" and .="ISIN"]/..')
+    values = {'name': isin_parent.xpath('../*[1]/text()').getall(), 'isin': isin_parent.xpath('*[2]/text()').getall(),
+              'wkn': isin_parent.xpath('*[4]/text()').getall(),
+              'benchmark_index': response.xpath('//p/a[@class="label label-default labelwrap"]/text()').get(),
+              'ter': response.xpath('//div[@class="h5" and contains(text(), "Kosten")]/../div[2]/div/div[1]/div[1]/'
+                                    'text()').get()}
+
+    risk_parent = response.xpath('//div[@class="h5" and contains(text(), "Risiko")]/..')
+    values['fund_size'] = risk_parent.xpath('div[2]/div/div[1]/div[1]/text()').get()
+
+    risk_table = response.xpath('//td/h3[contains(text(), "Replikationsmethode")]/../../..')
+    table = get_table_values(risk_table, 7, '/td[2]/text()')
+    values.update({'replication': risk_table.xpath('*[1]/td[2]/span[1]/text()').get(), 'legal_structure': table[1],
+                   'strategy_risk': table[2], 'fund_currency': table[3], 'currency_risk': table[4],
+                   'volatility_one_year': risk_table.xpath('*[6]/td[2]/span[1]/text()').get(), 'inception': table[6]})
+
+    dividend_table = response.xpath('//td[contains(text(), "Ausschüttung")]/../..')
+    table = get_table_values(dividend_table, 4, '/td[2]/text()')
+    values.update({'distribution_policy': table[0], 'distribution_frequency': table[1], 'fund_domicile': table[2],
+                   'tax_data': dividend_table.xpath('*[4]/td[2]/a/@href').get()})
+
+    legal_structure_table = response.xpath('//td[contains(text(), "Fondsstruktur")]/../..')
+    table = get_table_values(legal_structure_table, 10, '/td[2]/text()')
+    values.update(zip(['fund_structure', 'ucits_compliance', 'fund_provider', 'administrator', 'investment_advisor',
+                       'custodian_bank', 'revision_company', 'fiscal_year_end_month', 'swiss_representative',
+                       'swiss_paying_agent'], table))
+
+    tax_status_table = response.xpath('//td[contains(text(), "Schweiz")]/../..')
+    table = get_table_values(tax_status_table, 3, '/td[2]/span/text()')
+    values.update(zip(['tax_switzerland', 'tax_austria', 'tax_uk'], table))
+
+    replication_table = response.xpath('//td[contains(text(), "Indextyp")]/../..')
+    table = get_table_values(replication_table, 5, '/td[2]/span/text()')
+    values.update(zip(['indextype', 'swap_counterparty', 'collateral_manager', 'securities_lending',
+                       'securities_lending_counterparty'], table))
+
+    return values
@@ -0,0 +1,169 @@
+import logging
+import secrets
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import FrozenSet, List
+
+import pandas as pd
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+import config
+from db import sql_engine
+from db.models import EtfHistory, HistoryVersion
+from price_panel import load_price_panel
+
+
+@dataclass
+class _CacheEntry:
+    """
+    A pivoted price matrix (dates x ISINs) covering the given ISINs and date range.
+
+    The matrix is stored without dropping incomplete dates, so subsets of it can be served exactly.
+    """
+    isins: FrozenSet[str]
+    start_date: date
+    end_date: date
+    prices: pd.DataFrame
+    version: int
+    size: int
+
+    def covers(self, isins, start_date, end_date, version):
+        return self.version == version and self.start_date <= start_date and end_date <= self.end_date \
+               and isins <= self.isins
+
+
+class PriceMatrixCache:
+    """
+    A process-wide LRU cache of pivoted price matrices keyed by ISIN set and date range.
+
+    Requests for sub-ranges or ISIN subsets of a cached matrix are answered by slicing the cached superset.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, session: Session, isins: List[str], start_date, end_date) -> pd.DataFrame:
+        """
+        Returns the price matrix for the given ISINs and date range with incomplete dates removed.
+        """
+        isins = frozenset(isins)
+        start_date, end_date = normalize_date_range(start_date, end_date)
+        version = history_version()
+
+        with self.lock:
+            entry = self.__lookup(isins, start_date, end_date, version)
+
+        if entry is None:
+            prices = _load_price_matrix(session, isins, start_date, end_date)
+            entry = _CacheEntry(isins, start_date, end_date, prices, version,
+                                int(prices.memory_usage(deep=True).sum()))
+            with self.lock:
+                self.__insert(entry)
+
+        prices = entry.prices.loc[start_date:end_date, [isin for isin in entry.prices.columns if isin in isins]]
+        return prices.dropna()
+
+    def clear(self):
+        """
+        Removes all cached price matrices.
+        """
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def __lookup(self, isins, start_date, end_date, version):
+        for key, entry in self.entries.items():
+            if entry.covers(isins, start_date, end_date, version):
+                self.entries.move_to_end(key)
+                logging.debug(f"Serving price matrix for {len(isins)} ISINs from cache")
+                return entry
+
+        return None
+
+    def __insert(self, entry: _CacheEntry):
+        # entries covered by the new entry will never be hit again
+        for key in [k for k, e in self.entries.items() if entry.covers(e.isins, e.start_date, e.end_date, e.version)
+                                                          or e.version != entry.version]:
+            self.size -= self.entries.pop(key).size
+
+        if entry.size > self.max_size:
+            logging.info(f"Price matrix of {entry.size} bytes exceeds the cache size and will not be cached")
+            return
+
+        self.entries[(entry.isins, entry.start_date, entry.end_date)] = entry
+        self.size += entry.size
+        while self.size > self.max_size:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= evicted.size
+
+
+def normalize_date_range(start_date, end_date):
+    """
+    Converts the date range to dates matching the same datapoint dates as the given (date)times would.
+    """
+    if isinstance(start_date, datetime):
+        has_time = start_date.time() != datetime.min.time()
+        start_date = start_date.date() + timedelta(days=1) if has_time else start_date.date()
+    if isinstance(end_date, datetime):
+        end_date = end_date.date()
+
+    return start_date, end_date
+
+
+def _load_price_matrix(session, isins, start_date, end_date):
+    """
+    Loads the prices for the given ISINs and date range from database and pivots them into a dates x ISINs matrix
+
+    If an up-to-date price panel has been materialized, the prices are sliced from the panel instead.
+    """
+    panel = load_price_panel(history_version())
+    if panel is not None:
+        return panel.price_matrix(isins, start_date, end_date)
+
+    query = session.query(EtfHistory.isin, EtfHistory.datapoint_date, EtfHistory.price) \
+        .filter(EtfHistory.datapoint_date.between(start_date, end_date)) \
+        .filter(EtfHistory.isin.in_(isins)).statement
+    prices = pd.read_sql(query, session.bind)
+    return prices.pivot(index='datapoint_date', columns='isin', values='price').sort_index()
+
+
+def history_version() -> int:
+    """
+    Returns a number that changes whenever the price history in database has been modified, 0 if it never has been.
+
+    The version is stored in database, so data cached on local disk is not served after switching databases.
+    """
+    with sql_engine.connect() as connection:
+        version = connection.execute(select(HistoryVersion.version).where(HistoryVersion.id == 1)).scalar()
+    return version or 0
+
+
+def mark_history_changed():
+    """
+    Invalidates all cached price matrices and data derived from the price history, including those held by other
+    processes such as a running GUI.
+    """
+    # random, so versions of different databases do not collide
+    statement = insert(HistoryVersion).values(id=1, version=secrets.randbits(63), changed_at=datetime.now())
+    statement = statement.on_conflict_do_update(index_elements=['id'], set_={
+        'version': statement.excluded.version, 'changed_at': statement.excluded.changed_at})
+    with sql_engine.begin() as connection:
+        connection.execute(statement)
+    price_matrix_cache.clear()
+
+
+price_matrix_cache = PriceMatrixCache(int(config.get_value('price-cache', 'max_size_mb') or 0) * 1024 * 1024)
+
+
+def get_price_matrix(session: Session, isins: List[str], start_date, end_date) -> pd.DataFrame:
+    """
+    Returns the dates x ISINs price matrix for the given ISINs and date range, served from cache if possible.
+    """
+    return price_matrix_cache.get(session, isins, start_date, end_date)
@@ -0,0 +1,139 @@
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+from numpy.lib.format import open_memmap
+from sqlalchemy.orm import Session
+
+import config
+from db.models import EtfHistory
+
+panel_dir = Path(config.cache_dir, 'price_panel')
+panel_files = {'prices': 'prices.npy', 'dates': 'dates.npy', 'isins': 'isins.npy'}
+meta_file = 'meta.json'
+chunk_size = 1000000
+
+_panel_lock = threading.Lock()
+_panel = None
+
+
+class PricePanel:
+    """
+    A dense dates x ISINs price matrix memory-mapped from local disk.
+
+    Missing prices are stored as NaN. The panel is shared between processes through the page cache, slicing it
+    only touches the pages of the requested dates and ISINs.
+    """
+
+    def __init__(self, directory: Path, version: int):
+        self.version = version
+        self.prices = np.load(Path(directory, panel_files['prices']), mmap_mode='r')
+        self.dates = np.load(Path(directory, panel_files['dates']))
+        self.isins = pd.Index(np.load(Path(directory, panel_files['isins'])))
+
+        if self.prices.shape != (len(self.dates), len(self.isins)):
+            raise ValueError("Price panel files do not match each other")
+
+    def price_matrix(self, isins: List[str], start_date, end_date) -> pd.DataFrame:
+        """
+        Returns the prices for the given ISINs and date range in the same shape as a pivot of etf_history would:
+        dates without any price and ISINs without any price in the range are left out.
+        """
+        rows = self.__row_slice(start_date, end_date)
+        cols = self.__columns(isins)
+        prices = pd.DataFrame(self.prices[rows][:, cols], index=self.__date_index(rows), columns=self.isins[cols])
+        prices.index.name = 'datapoint_date'
+        prices.columns.name = 'isin'
+        return prices.dropna(how='all').dropna(axis=1, how='all')
+
+    def isins_with_data(self, isins: List[str], start_date, end_date) -> List[str]:
+        """
+        Returns the given ISINs having at least one price within the date range
+        """
+        rows = self.__row_slice(start_date, end_date)
+        cols = self.__columns(isins)
+        has_data = ~np.isnan(self.prices[rows][:, cols]).all(axis=0)
+        return self.isins[cols][has_data].tolist()
+
+    def __row_slice(self, start_date, end_date):
+        start = np.searchsorted(self.dates, np.datetime64(start_date, 'D'), side='left')
+        end = np.searchsorted(self.dates, np.datetime64(end_date, 'D'), side='right')
+        return slice(start, end)
+
+    def __columns(self, isins):
+        cols = self.isins.get_indexer(sorted(set(isins)))
+        return cols[cols >= 0]
+
+    def __date_index(self, rows):
+        return pd.Index(self.dates[rows].astype(object))
+
+
+def load_price_panel(version: int) -> Optional[PricePanel]:
+    """
+    Returns the price panel if it has been materialized for the given history version, otherwise None.
+    """
+    global _panel
+
+    with _panel_lock:
+        if _panel is not None and _panel.version == version:
+            return _panel
+
+        _panel = None
+        try:
+            with open(Path(panel_dir, meta_file)) as f:
+                meta = json.load(f)
+            if meta['version'] == version:
+                _panel = PricePanel(panel_dir, version)
+        except (OSError, ValueError, KeyError):
+            logging.info("No up-to-date price panel available, prices are read from database")
+
+        return _panel
+
+
+def materialize_price_panel(session: Session, version: int):
+    """
+    Dumps the etf_history table into a dense dates x ISINs panel on local disk.
+
+    The prices are streamed from database in chunks through a server-side cursor, so memory usage is bounded by the
+    chunk size.
+    """
+    panel_dir.mkdir(parents=True, exist_ok=True)
+
+    dates = np.array([d for (d,) in session.query(EtfHistory.datapoint_date).distinct()
+                     .order_by(EtfHistory.datapoint_date)], dtype='datetime64[D]')
+    isins = np.array([i for (i,) in session.query(EtfHistory.isin).distinct().order_by(EtfHistory.isin)], dtype=str)
+    date_index = pd.Index(dates)
+    isin_index = pd.Index(isins)
+
+    tmp = {k: Path(panel_dir, f + '.tmp') for k, f in panel_files.items()}
+    prices = open_memmap(tmp['prices'], mode='w+', dtype=np.float64, shape=(len(dates), len(isins)))
+    prices[:] = np.nan
+
+    query = session.query(EtfHistory.isin, EtfHistory.datapoint_date, EtfHistory.price).statement
+    # a server-side cursor, otherwise the driver buffers the whole result before the first chunk is returned
+    with session.bind.connect().execution_options(stream_results=True) as connection:
+        for chunk in pd.read_sql(query, connection, chunksize=chunk_size):
+            rows = date_index.get_indexer(pd.to_datetime(chunk['datapoint_date']).values.astype('datetime64[D]'))
+            cols = isin_index.get_indexer(chunk['isin'])
+            prices[rows, cols] = chunk['price'].values
+
+    prices.flush()
+    del prices
+    with open(tmp['dates'], 'wb') as f:
+        np.save(f, dates)
+    with open(tmp['isins'], 'wb') as f:
+        np.save(f, isins)
+
+    # the panel is invalid while its files are being replaced, readers fall back to database meanwhile
+    Path(panel_dir, meta_file).unlink(missing_ok=True)
+    for k, f in panel_files.items():
+        os.replace(tmp[k], Path(panel_dir, f))
+    with open(Path(panel_dir, meta_file), 'w') as f:
+        json.dump({'version': version}, f)
+
+    logging.info(f"Materialized price panel with {len(dates)} dates and {len(isins)} ISINs")
@@ -0,0 +1,46 @@
+import asyncio
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket limiting the rate of API requests.
+
+    Tokens are refilled continuously at rate tokens per second up to capacity. acquire blocks the calling thread until a
+    token is available, acquire_async suspends the calling coroutine instead.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            wait = self.__take()
+            if wait == 0:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        while True:
+            wait = self.__take()
+            if wait == 0:
+                return
+            await asyncio.sleep(wait)
+
+    def __take(self):
+        """
+        Takes a token and returns 0 or returns how long to wait until a token is available
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
@@ -0,0 +1,96 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import tempfile
+import time
+from pathlib import Path
+
+import config
+
+results_dir = Path(config.cache_dir, 'results')
+
+
+class ResultCache:
+    """
+    A persistent cache for optimization results stored on local disk, so it is shared by all server processes.
+
+    Entries expire after ttl seconds. If the cache grows beyond max_size bytes, the least recently used entries are
+    removed.
+    """
+
+    def __init__(self, directory: Path, ttl: float, max_size: int):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_size = max_size
+
+    def get(self, key: str):
+        """
+        Returns the cached value for the key or None if there is no valid entry
+        """
+        path = self.__path(key)
+        try:
+            with open(path, 'rb') as f:
+                created, value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+        if time.time() - created > self.ttl:
+            path.unlink(missing_ok=True)
+            return None
+
+        # the modification time tracks the last access for evicting least recently used entries
+        os.utime(path)
+        return value
+
+    def put(self, key: str, value):
+        """
+        Stores the value for the key and evicts expired and least recently used entries
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((time.time(), value), f)
+            os.replace(tmp, self.__path(key))
+        except (OSError, pickle.PicklingError):
+            logging.warning("Could not store optimization result in cache")
+            Path(tmp).unlink(missing_ok=True)
+            return
+
+        self.__evict()
+
+    def __evict(self):
+        entries = []
+        for path in self.directory.glob('*.pickle'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue  # removed by another process
+            if time.time() - stat.st_mtime > self.ttl:
+                path.unlink(missing_ok=True)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        size = sum(s for _, s, _ in entries)
+        for _, entry_size, path in sorted(entries, key=lambda e: e[0]):
+            if size <= self.max_size:
+                break
+            path.unlink(missing_ok=True)
+            size -= entry_size
+
+    def __path(self, key):
+        return Path(self.directory, key + '.pickle')
+
+
+def make_key(**inputs) -> str:
+    """
+    Creates a cache key from canonicalized inputs. Lists are treated as sets, their order does not matter.
+    """
+    canonical = {k: sorted(v) if isinstance(v, (list, set, tuple)) else v for k, v in inputs.items()}
+    return hashlib.sha256(json.dumps(canonical, sort_keys=True, default=str).encode()).hexdigest()
+
+
+result_cache = ResultCache(results_dir, float(config.get_value('result-cache', 'ttl')),
+                           int(config.get_value('result-cache', 'max_size_mb')) * 1024 * 1024)
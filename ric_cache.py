@@ -0,0 +1,63 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from db.models import EtfRic
+
+TIMESERIES = 'timeseries'
+GET_DATA = 'get_data'
+
+
+@dataclass
+class RicEntry:
+    """
+    What previous imports have learned about retrieving the prices of an ISIN
+    """
+    ric: Optional[str]
+    resolved_at: Optional[datetime]
+    data_path: Optional[str]
+    no_data_since: Optional[datetime]
+
+    def needs_lookup(self, now: datetime, ttl: timedelta):
+        return self.resolved_at is None or now - self.resolved_at > ttl
+
+    def is_dead(self, now: datetime, ttl: timedelta):
+        return self.no_data_since is not None and now - self.no_data_since <= ttl
+
+
+def load_ric_entries(session: Session) -> Dict[str, RicEntry]:
+    """
+    Returns the stored RIC entries of all ISINs
+    """
+    rows = session.query(EtfRic.isin, EtfRic.ric, EtfRic.resolved_at, EtfRic.data_path, EtfRic.no_data_since)
+    return {isin: RicEntry(*entry) for isin, *entry in rows}
+
+
+def save_rics(session: Session, rics: Dict[str, Optional[str]]):
+    """
+    Stores the resolved RICs, None for ISINs without RIC
+    """
+    if not rics:
+        return
+
+    now = datetime.now()
+    statement = insert(EtfRic).values([{'isin': isin, 'ric': ric, 'resolved_at': now} for isin, ric in rics.items()])
+    statement = statement.on_conflict_do_update(index_elements=['isin'], set_={'ric': statement.excluded.ric,
+                                                                               'resolved_at': now})
+    session.execute(statement)
+    session.commit()
+
+
+def save_fetch_result(session: Session, isin: str, data_path: Optional[str]):
+    """
+    Stores which request returned the prices of the ISIN, None if no request succeeded
+    """
+    values = {'data_path': data_path, 'no_data_since': None} if data_path is not None \
+        else {'no_data_since': datetime.now()}
+    statement = insert(EtfRic).values(isin=isin, **values)
+    statement = statement.on_conflict_do_update(index_elements=['isin'], set_=values)
+    session.execute(statement)
+    session.commit()
@@ -9,13 +9,18 @@ from scrapy.utils.project import get_project_settings
 from sqlalchemy import MetaData
 
 import config
-from db import sql_engine
-from db.table_manager import drop_static_tables
+from db import Session, sql_engine
+from db.table_manager import create_table, drop_static_tables, migrate
 from etf_history_api import save_history_api
-#from etf_history_excel import save_history_excel
+from etf_history_excel import save_history_excel
 from extraetf import Extraetf
+from import_benchmark import run_import_benchmark
 from frontend.app import run_gui
+from history_writer import seed_sync_state
+from http_cache import MODES, REPLAY
 from isin_extractor import extract_isins_from_db
+from parse_benchmark import run_parse_benchmark
+from price_cache import mark_history_changed
 
 
 class AsciiArtGroup(click.Group):
@@ -41,9 +46,16 @@ def set_log_level(level):
     root.addHandler(handler)
 
 
-def run_crawler(name: str):
-    process = CrawlerProcess(get_project_settings())
-    process.crawl(name)
+def run_crawler(name: str, http_cache=None, **kwargs):
+    settings = get_project_settings()
+    if http_cache is not None:
+        settings.set('HTTPCACHE_ENABLED', True)
+        settings.set('HTTPCACHE_IGNORE_MISSING', http_cache == REPLAY)
+        # recorded responses are parsed as fast as possible
+        settings.set('AUTOTHROTTLE_ENABLED', http_cache != REPLAY)
+
+    process = CrawlerProcess(settings)
+    process.crawl(name, **kwargs)
     process.start()
 
 
@@ -61,26 +73,47 @@ def drop_static_data():
     click.echo('Successfully dropped tables')
 
 
+@etfopt.command(name='migrate')
+def migrate_db():
+    """
+    Creates missing tables and indexes in an existing database
+    """
+    click.echo("Migrating database. Creating indexes on large tables might take a while ...")
+    created = migrate(sql_engine)
+    if created:
+        click.echo(f"Created columns and indexes: {', '.join(created)}")
+    __seed_sync_state()
+    click.echo('Database is up to date')
+
+
 @etfopt.command()
-def crawl_extraetf():
+@click.option('--full', is_flag=True, help='refresh all ETFs, including those unchanged since the last crawl')
+@click.option('--http-cache', type=click.Choice(MODES), help='record responses on disk or replay recorded responses')
+def crawl_extraetf(full, http_cache):
     """
     Runs a crawler for retrieving data from extraetf.com
     """
     click.echo("Starting to crawl extraetf.com. Wait until you see the finish message. This might take a while ...")
-    extraetf = Extraetf()
+    extraetf = Extraetf(full, http_cache)
     extraetf.collect_data()
 
     click.echo('Finished crawling extraetf.com')
 
 
 @etfopt.command()
-def crawl_justetf():
+@click.option('--browser', is_flag=True, help='page through the ETF table in a headless Chrome instead of requesting '
+                                              'its data directly')
+@click.option('--http-cache', type=click.Choice(MODES), help='record responses on disk or replay recorded responses')
+def crawl_justetf(browser, http_cache):
     """
     Runs a crawler for retrieving data from justetf.com
     """
+    if browser and http_cache == REPLAY:
+        raise click.UsageError('The listing in the browser cannot be replayed, omit --browser')
+
     try:
         click.echo("Starting to crawl justetf.com. Wait until you see the finish message. This might take a while ...")
-        run_crawler('justetf')
+        run_crawler('justetf', http_cache, listing='browser' if browser else 'data')
         click.echo('Finished crawling the justetf.com website')
     except:
         click.echo('Failed crawling the justetf.com website')
@@ -97,29 +130,57 @@ def extract_isins(outfile):
     click.echo(f"Wrote ISINs into {outfile}")
 
 
-#@etfopt.command()
-#@click.option('--historyfile', '-h', default='etf_history.csv',
-              #help='csv file containing etf history (output from Refinitiv)')
-#@click.option('--isinfile', '-i', default='isin.csv', help='helper csv file containing isins')
-#def import_history_excel(historyfile, isinfile):
-    #"""
-    #Retrieves historic etf data from Refinitiv (Excel)
-    #"""
-    #click.echo("Getting etf history...")
-    #save_history_excel(historyfile, isinfile)
-    #click.echo('Finished retrieving etf history')
+@etfopt.command()
+@click.option('--historyfile', '-h', default='etf_history.csv',
+              help='csv or xlsx file containing etf history (output from Refinitiv)')
+@click.option('--isinfile', '-i', default='isin.csv', help='helper csv file containing isins')
+def import_history_excel(historyfile, isinfile):
+    """
+    Retrieves historic etf data from Refinitiv (Excel)
+    """
+    click.echo("Getting etf history...")
+    save_history_excel(historyfile, isinfile)
+    click.echo('Finished retrieving etf history')
 
 
 @etfopt.command()
-def import_history():
+@click.option('--resume', is_flag=True, help='continue the last interrupted import')
+def import_history(resume):
     """
     Retrieves historic etf data from Refinitiv (API)
     """
     click.echo("Getting etf history...")
-    save_history_api()
+    save_history_api(resume)
     click.echo('Finished retrieving etf history')
 
 
+@etfopt.command()
+@click.option('--isins', '-n', default=100, help='number of ISINs to import')
+@click.option('--days', '-m', default=2500, help='number of days of synthetic prices per ISIN')
+@click.option('--latency', '-l', default=0.05, help='simulated latency of each API request in seconds')
+@click.option('--directory', '-d', default=None, help='directory with recorded price series (<isin>.csv) to replay')
+def bench_import(isins, days, latency, directory):
+    """
+    Measures the throughput of the history import with replayed prices
+    """
+    click.echo(f"Importing {isins} ISINs from replayed price data...")
+    stats = run_import_benchmark(isins, days, latency, directory)
+    click.echo(stats.report())
+
+
+@etfopt.command()
+@click.option('--directory', '-d', default=None, help='directory with saved justetf.com profile pages (*.html), '
+                                                      'defaults to the pages recorded in the HTTP cache')
+@click.option('--repeat', '-r', default=3, help='number of times each page is parsed')
+def bench_parse(directory, repeat):
+    """
+    Measures the throughput of extracting justetf.com profile pages
+    """
+    click.echo("Parsing saved justetf.com profile pages...")
+    stats = run_parse_benchmark(directory, repeat)
+    click.echo(stats.report())
+
+
 @etfopt.command()
 @click.option('--file', '-f', default='backup.sql', help='path to database import file')
 def import_db(file):
@@ -146,6 +207,11 @@ def import_db(file):
         except subprocess.CalledProcessError:
             click.echo("Importing the etf database failed")
         click.echo(result)
+
+        # the local price panel and caches were derived from the dropped price history
+        create_table(sql_engine)
+        __seed_sync_state()
+        mark_history_changed()
     else:
         click.echo("Import aborted")
 
@@ -175,6 +241,14 @@ def start_gui():
     run_gui()
 
 
+def __seed_sync_state():
+    session = Session()
+    seeded = seed_sync_state(session)
+    session.close()
+    if seeded:
+        click.echo(f"Initialized the sync state of {seeded} ISINs from their price history")
+
+
 if __name__ == '__main__':
     set_log_level(logging.WARNING)
     etfopt()
@@ -0,0 +1,74 @@
+from typing import Dict, List, Optional, Union
+
+from lxml import etree
+
+
+class Section:
+    """
+    A part of a page located once by its anchor XPath, from which values are extracted relative to the anchor.
+
+    values maps fields to XPaths evaluated on the anchor. Fields in all_values keep all matches instead of the first.
+    For tables, the cell XPath is evaluated on each row below the anchor in one pass and the value of the n-th row is
+    assigned to the n-th of row_fields, rows without field (None) are skipped.
+    """
+
+    def __init__(self, anchor: str, values: Dict[str, str] = None, all_values=(), cell: str = None,
+                 row_fields: List[Optional[str]] = ()):
+        self.anchor = etree.XPath(anchor)
+        self.values = {field: etree.XPath(path) for field, path in (values or {}).items()}
+        self.all_values = set(all_values)
+        self.cell = etree.XPath(cell) if cell is not None else None
+        self.row_fields = row_fields
+
+    def extract(self, root) -> Dict[str, Union[str, List[str], None]]:
+        anchors = self.anchor(root)
+        result = {}
+        for field, path in self.values.items():
+            matches = [str(match) for anchor in anchors for match in path(anchor)]
+            result[field] = matches if field in self.all_values else next(iter(matches), None)
+
+        if self.cell is not None:
+            result.update({field: None for field in self.row_fields if field is not None})
+            for anchor in anchors:
+                rows = [child for child in anchor if isinstance(child.tag, str)]
+                for field, row in zip(self.row_fields, rows):
+                    if field is not None and result[field] is None:
+                        result[field] = next((str(match) for match in self.cell(row)), None)
+
+        return result
+
+
+justetf_detail_sections = [
+    Section('//span[@class="vallabel" and .="ISIN"]/..',
+            values={'name': '../*[1]/text()', 'isin': '*[2]/text()', 'wkn': '*[4]/text()'},
+            all_values=('name', 'isin', 'wkn')),
+    Section('//p/a[@class="label label-default labelwrap"]', values={'benchmark_index': 'text()'}),
+    Section('//div[@class="h5" and contains(text(), "Kosten")]/..', values={'ter': 'div[2]/div/div[1]/div[1]/text()'}),
+    Section('//div[@class="h5" and contains(text(), "Risiko")]/..',
+            values={'fund_size': 'div[2]/div/div[1]/div[1]/text()'}),
+    Section('//td/h3[contains(text(), "Replikationsmethode")]/../../..',
+            values={'replication': '*[1]/td[2]/span[1]/text()', 'volatility_one_year': '*[6]/td[2]/span[1]/text()'},
+            cell='td[2]/text()',
+            row_fields=[None, 'legal_structure', 'strategy_risk', 'fund_currency', 'currency_risk', None, 'inception']),
+    Section('//td[contains(text(), "Ausschüttung")]/../..', values={'tax_data': '*[4]/td[2]/a/@href'},
+            cell='td[2]/text()', row_fields=['distribution_policy', 'distribution_frequency', 'fund_domicile']),
+    Section('//td[contains(text(), "Fondsstruktur")]/../..', cell='td[2]/text()',
+            row_fields=['fund_structure', 'ucits_compliance', 'fund_provider', 'administrator', 'investment_advisor',
+                        'custodian_bank', 'revision_company', 'fiscal_year_end_month', 'swiss_representative',
+                        'swiss_paying_agent']),
+    Section('//td[contains(text(), "Schweiz")]/../..', cell='td[2]/span/text()',
+            row_fields=['tax_switzerland', 'tax_austria', 'tax_uk']),
+    Section('//td[contains(text(), "Indextyp")]/../..', cell='td[2]/span/text()',
+            row_fields=['indextype', 'swap_counterparty', 'collateral_manager', 'securities_lending',
+                        'securities_lending_counterparty']),
+]
+
+
+def extract_justetf_detail(root) -> Dict[str, Union[str, List[str], None]]:
+    """
+    Extracts the values of all fields from the parsed document of a justetf.com ETF profile page
+    """
+    result = {}
+    for section in justetf_detail_sections:
+        result.update(section.extract(root))
+    return result
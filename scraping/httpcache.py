@@ -0,0 +1,39 @@
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+
+from http_cache import CachedResponse, ResponseStore
+
+
+class ResponseStoreCacheStorage:
+    """
+    Scrapy HTTP cache storage keeping the responses in the ResponseStore shared with the extraetf.com crawler.
+
+    Responses do not expire. With HTTPCACHE_IGNORE_MISSING set, requests without stored response are dropped, which
+    replays a recorded crawl.
+    """
+
+    def __init__(self, settings):
+        self.store = ResponseStore()
+
+    def open_spider(self, spider):
+        pass
+
+    def close_spider(self, spider):
+        pass
+
+    def retrieve_response(self, spider, request):
+        cached = self.store.load(request.method, request.url, request.body)
+        if cached is None:
+            return None
+
+        headers = Headers()
+        for name, value in cached.headers:
+            headers.appendlist(name, value)
+        response_cls = responsetypes.from_args(headers=headers, url=cached.url, body=cached.body)
+        return response_cls(url=cached.url, status=cached.status, headers=headers, body=cached.body)
+
+    def store_response(self, spider, request, response):
+        headers = [(name.decode('latin-1'), value.decode('latin-1'))
+                   for name, values in response.headers.items() for value in values]
+        self.store.save(request.method, request.url, request.body,
+                        CachedResponse(response.url, response.status, headers, response.body))
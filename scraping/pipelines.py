@@ -5,6 +5,11 @@
 
 
 import logging
+import time
+
+import click
+from sqlalchemy.dialects.postgresql import insert
+from twisted.internet import defer, threads
 
 from db import sql_engine, Session
 from db.models import Etf
@@ -12,36 +17,91 @@ from db.table_manager import create_table
 
 
 class EtfPipeline:
+    """
+    Stores new ETFs in the database in batches.
+
+    The ISINs already stored are loaded when the spider opens. New items are buffered and written every flush_size items
+    and when the spider closes. Writes run one after another on a thread of the reactor's pool, so the crawl is not
+    blocked by the database.
+    """
 
-    def __init__(self):
+    def __init__(self, flush_size=100):
         create_table(sql_engine)
+        self.flush_size = flush_size
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings.getint('ETF_PIPELINE_FLUSH_SIZE', 100))
 
     def open_spider(self, spider):
         self.session = Session()
+        self.known = {isin for (isin,) in self.session.query(Etf.isin)}
+        self.session.commit()
+
+        self.buffer = []
+        self.writes = defer.succeed(None)
+        self.items = 0
+        self.written = 0
+        self.start = time.perf_counter()
 
     def close_spider(self, spider):
-        self.session.close()
+        self.__flush()
+        self.writes.addBoth(self.__finish)
+        return self.writes
 
     def process_item(self, item, spider):
         """
-        Converts each extracted item from a scrapy item into an sqlalchemy item, then stores it in the database.
+        Converts each extracted item from a scrapy item into an sqlalchemy item and buffers it for storing in the database.
         """
         etf = item.to_etfitemdb()
         logging.info(f"Preparing to save {etf.name} in database")
+        self.items += 1
+
+        if etf.isin in self.known:
+            logging.warning(f'Updated values are not reflected in database for values scraped from justetf.com. '
+                            f'Please delete this table if you want to get fresh values into the database and '
+                            f'ensure extraetf.com is first scraped.')
+        else:
+            self.known.add(etf.isin)
+            self.buffer.append(etf)
+            if len(self.buffer) >= self.flush_size:
+                self.__flush()
+
+        return item
 
+    def __flush(self):
+        """
+        Queues the buffered ETFs for writing after the previous writes have finished
+        """
+        if not self.buffer:
+            return
+
+        etfs, self.buffer = self.buffer, []
+        self.writes.addCallback(lambda _: threads.deferToThread(self.__write, etfs))
+        self.writes.addErrback(self.__log_failure, etfs)
+
+    def __write(self, etfs):
+        start = time.perf_counter()
+        rows = [{column.name: getattr(etf, column.name) for column in Etf.__table__.columns} for etf in etfs]
         try:
-            etf_current = self.session.query(Etf)
-            exists = etf_current.filter_by(isin=etf.isin).first() is not None
-            if exists:
-                logging.warning(f'Updated values are not reflected in database for values scraped from justetf.com. '
-                                f'Please delete this table if you want to get fresh values into the database and '
-                                f'ensure extraetf.com is first scraped.')
-            else:
-                self.session.add(etf)
-                self.session.commit()
+            # ETFs stored by extraetf in the meantime are kept
+            self.session.execute(insert(Etf).values(rows).on_conflict_do_nothing(index_elements=['isin']))
+            self.session.commit()
         except:
-            logging.warning(f"Could not save data for {etf.name}!")
             self.session.rollback()
             raise
 
-        return item
+        self.written += len(etfs)
+        elapsed = time.perf_counter() - self.start
+        logging.info(f"Flushed {len(etfs)} ETFs in {time.perf_counter() - start:.2f}s, "
+                     f"{self.items / elapsed:.1f} items/s")
+
+    @staticmethod
+    def __log_failure(failure, etfs):
+        logging.error(f"Could not save data for {', '.join(etf.isin for etf in etfs)}: {failure.getErrorMessage()}")
+
+    def __finish(self, _):
+        elapsed = time.perf_counter() - self.start
+        click.echo(f"Stored {self.written} new of {self.items} scraped ETFs in {elapsed:.1f}s "
+                   f"({self.items / elapsed:.1f} items/s)")
+        self.session.close()
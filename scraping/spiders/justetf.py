@@ -1,22 +1,31 @@
 import click
-import time
 
 import scrapy
-from scrapy import Request
+from scrapy import FormRequest, Request
 from scrapy.selector import Selector
 from selenium import webdriver
-from selenium.common.exceptions import NoSuchElementException
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions
+from selenium.webdriver.support.ui import WebDriverWait
 
+from scraping.extractors import extract_justetf_detail
 from scraping.items import EtfItem, EtfItemLoader
 
 
 class JustetfSpider(scrapy.Spider):
     """
     Spider for crawling justetf.com
+
+    By default the ETF listing is retrieved from the data request backing the table on the search page, so no browser
+    is needed. With the spider argument listing=browser the table is paged through in a headless Chrome instead.
     """
     name = 'justetf'
     allowed_domains = ['justetf.com']
     start_urls = ['https://justetf.com/de/find-etf.html']
+    table_url = 'https://www.justetf.com/servlet/etfs-table'
+    profile_url = 'https://www.justetf.com/de/etf-profile.html?isin={}'
+    row_xpath = '//tbody/tr[@role="row"]'
     custom_settings = {
         'ITEM_PIPELINES': {
             'scraping.pipelines.EtfPipeline': 300
@@ -24,32 +33,72 @@ class JustetfSpider(scrapy.Spider):
         'LOG_LEVEL': 'WARNING'
     }
 
-    def __init__(self, *a, **kw):
+    def __init__(self, listing='data', *a, **kw):
         """
         Creates a spider for crawling justetf.com website.
-        Prepares a chrome driver for parsing items.
+        Prepares a chrome driver for parsing items if the listing is retrieved through the browser.
         """
         super().__init__(*a, **kw)
+        self.listing = listing
+        self.driver = None
+
+        if self.listing == 'browser':
+            # Use headless option to not open a new browser window
+            options = webdriver.ChromeOptions()
+            options.add_argument("headless")
+            desired_capabilities = options.to_capabilities()
+            self.driver = webdriver.Chrome(desired_capabilities=desired_capabilities)
 
-        # Use headless option to not open a new browser window
-        options = webdriver.ChromeOptions()
-        options.add_argument("headless")
-        desired_capabilities = options.to_capabilities()
-        self.driver = webdriver.Chrome(desired_capabilities=desired_capabilities)
+    def closed(self, reason):
+        if self.driver is not None:
+            self.driver.quit()
 
     def parse(self, response, **kwargs):
         click.echo("Begin parsing ...")
+        if self.listing == 'browser':
+            yield from self.parse_browser_listing(response)
+        else:
+            yield self.table_request(0)
+
+    def table_request(self, start):
+        """
+        Requests the rows of the ETF table beginning with start, like the table on the search page does
+        """
+        page_size = self.settings.getint('JUSTETF_TABLE_PAGE_SIZE')
+        formdata = {'draw': str(start // page_size + 1), 'start': str(start), 'length': str(page_size),
+                    'lang': 'de', 'country': 'DE', 'universeType': 'private', 'etfsParams': 'query='}
+        return FormRequest(self.table_url, formdata=formdata, callback=self.parse_table, cb_kwargs={'start': start})
+
+    def parse_table(self, response, start):
+        """
+        Requests the detail page of each ETF in the table rows and the next rows until all are retrieved
+        """
+        data = response.json()
+        for row in data['data']:
+            yield Request(self.profile_url.format(row['isin']), callback=self.parse_item)
+
+        page_size = self.settings.getint('JUSTETF_TABLE_PAGE_SIZE')
+        click.echo(f"Extracted etfs from page {start // page_size + 1}")
+        if data['data'] and start + page_size < data['recordsTotal']:
+            yield self.table_request(start + page_size)
+
+    def parse_browser_listing(self, response):
+        """
+        Pages through the ETF table on the search page in a headless Chrome
+        """
+        timeout = self.settings.getfloat('JUSTETF_BROWSER_TIMEOUT')
+        wait = WebDriverWait(self.driver, timeout)
+
         # load first page second time, this time through selenium
         self.driver.get(response.url)
-        time.sleep(3)
+        wait.until(expected_conditions.presence_of_element_located((By.XPATH, self.row_xpath)))
 
         self.handle_cookies_popup('//a[@id="CybotCookiebotDialogBodyLevelButtonLevelOptinAllowallSelection"]')
 
         pagenum = 1
         while True:
-            time.sleep(2.5)  # give enough time for updating contents inside selenium browser
             r = Selector(text=self.driver.page_source)
-            for link in r.xpath('//tbody/tr[@role="row"]/td/a[@class="link"]/@href').getall():
+            for link in r.xpath(self.row_xpath + '/td/a[@class="link"]/@href').getall():
                 click.echo("Found link:" + link)
                 yield Request(link, callback=self.parse_item)
 
@@ -61,22 +110,13 @@ class JustetfSpider(scrapy.Spider):
                     or disabled != -1:
                 break
 
-            # enable for debugging only
-            # if next_page != 1:
-            #    break
-
             # a hacky fix for not being able to click on the next_page button
             # https://stackoverflow.com/questions/48665001/can-not-click-on-a-element-elementclickinterceptedexception-in-splinter-selen
+            first_row = self.driver.find_element_by_xpath(self.row_xpath)
             self.driver.execute_script("arguments[0].click();", next_page)
-
-    @staticmethod
-    def get_table_values(selector, table_size, path):
-        """
-        Gets the text contents of a table given the selector, table_size and an path.
-        """
-        # xpath counting starts with one :/
-        values = [selector.xpath('*[' + str(i) + ']' + path).get() for i in range(1, table_size + 1)]
-        return values
+            # the table replaces its rows once the next page has been loaded
+            wait.until(expected_conditions.staleness_of(first_row))
+            wait.until(expected_conditions.presence_of_element_located((By.XPATH, self.row_xpath)))
 
     def handle_cookies_popup(self, accept_xpath):
         """
@@ -84,83 +124,25 @@ class JustetfSpider(scrapy.Spider):
         """
         try:
             # cookie settings: allow selection
-            allow_selection_button = self.driver.find_element_by_xpath(accept_xpath)
+            wait = WebDriverWait(self.driver, self.settings.getfloat('JUSTETF_COOKIE_TIMEOUT'))
+            allow_selection_button = wait.until(expected_conditions.element_to_be_clickable((By.XPATH, accept_xpath)))
             allow_selection_button.click()
-            time.sleep(0.5)
-        except NoSuchElementException:
+            wait.until(expected_conditions.invisibility_of_element_located((By.XPATH, accept_xpath)))
+        except TimeoutException:
             click.echo("No cookie message was found. Continuing ...")
 
     def parse_item(self, response):
         """
         Parses the contents of a given webpage (response) into an EtfItem.
         """
-        isin_parent = response.xpath('//span[@class="vallabel" and .="ISIN"]/..')
-        name = isin_parent.xpath('../*[1]/text()').getall()
-        click.echo(f"Parsing ETF '{name}'")
-
-        isin = isin_parent.xpath('*[2]/text()').getall()
-        wkn = isin_parent.xpath('*[4]/text()').getall()
+        values = extract_justetf_detail(response.selector.root)
+        click.echo(f"Parsing ETF '{values['name']}'")
 
         l = EtfItemLoader(item=EtfItem(), response=response)
         for field in l.item.fields:
             l.item.setdefault(field, None)
 
-        l.add_value('name', name)
-        l.add_value('isin', isin)
-        l.add_value('wkn', wkn)
-
-        benchmark_index = response.xpath('//p/a[@class="label label-default labelwrap"]/text()').get()
-        l.add_value('benchmark_index', benchmark_index)
-
-        ter = response.xpath(
-            '//div[@class="h5" and contains(text(), "Kosten")]/../div[2]/div/div[1]/div[1]/text()').get()
-        l.add_value('ter', ter)
-
-        risk_parent = response.xpath('//div[@class="h5" and contains(text(), "Risiko")]/..')
-        l.add_value('fund_size', risk_parent.xpath('div[2]/div/div[1]/div[1]/text()').get())
-
-        risk_table = response.xpath('//td/h3[contains(text(), "Replikationsmethode")]/../../..')
-        values = self.get_table_values(risk_table, 7, '/td[2]/text()')
-        l.add_value('replication', risk_table.xpath('*[1]/td[2]/span[1]/text()').get())
-        l.add_value('legal_structure', values[1])
-        l.add_value('strategy_risk', values[2])
-        l.add_value('fund_currency', values[3])
-        l.add_value('currency_risk', values[4])
-        l.add_value('volatility_one_year', risk_table.xpath('*[6]/td[2]/span[1]/text()').get())
-        l.add_value('inception', values[6])
-
-        dividend_table = response.xpath('//td[contains(text(), "Ausschüttung")]/../..')
-        values = self.get_table_values(dividend_table, 4, '/td[2]/text()')
-        l.add_value('distribution_policy', values[0])
-        l.add_value('distribution_frequency', values[1])
-        l.add_value('fund_domicile', values[2])
-        l.add_value('tax_data', dividend_table.xpath('*[4]/td[2]/a/@href').get())
-
-        legal_structure_table = response.xpath('//td[contains(text(), "Fondsstruktur")]/../..')
-        values = self.get_table_values(legal_structure_table, 10, '/td[2]/text()')
-        l.add_value('fund_structure', values[0])
-        l.add_value('ucits_compliance', values[1])
-        l.add_value('fund_provider', values[2])
-        l.add_value('administrator', values[3])
-        l.add_value('investment_advisor', values[4])
-        l.add_value('custodian_bank', values[5])
-        l.add_value('revision_company', values[6])
-        l.add_value('fiscal_year_end_month', values[7])
-        l.add_value('swiss_representative', values[8])
-        l.add_value('swiss_paying_agent', values[9])
-
-        tax_status_table = response.xpath('//td[contains(text(), "Schweiz")]/../..')
-        values = self.get_table_values(tax_status_table, 3, path='/td[2]/span/text()')
-        l.add_value('tax_switzerland', values[0])
-        l.add_value('tax_austria', values[1])
-        l.add_value('tax_uk', values[2])
-
-        replication_table = response.xpath('//td[contains(text(), "Indextyp")]/../..', )
-        values = self.get_table_values(replication_table, 5, path='/td[2]/span/text()')
-        l.add_value('indextype', values[0])
-        l.add_value('swap_counterparty', values[1])
-        l.add_value('collateral_manager', values[2])
-        l.add_value('securities_lending', values[3])
-        l.add_value('securities_lending_counterparty', values[4])
+        for field, value in values.items():
+            l.add_value(field, value)
 
         return l.load_item()
@@ -15,6 +15,7 @@ setup(
         'sqlalchemy-utils>=0.37,<0.38',
         'pandas>=1.3.3,<1.4',
         'requests>=2.26,<2.27',
+        'httpx>=0.18,<1.0',
         'dash>=1.21,<2.0',
         'dash-bootstrap-components>=0.12.0,<0.13',
         'PyPortfolioOpt>=1.4.1,<1.5.0',